@@ -0,0 +1,62 @@
+from array import array
+import numpy
+
+
+class BatchPostings:
+    """
+    Postings of a batch of documents, appended as (term id, document, occurrences) columns of typed arrays while the
+    documents are read, then grouped by term id. The documents of a term stay in the order of indexing, and the TF is
+    computed at once from the occurrences and the maximum frequency of each document.
+    """
+    def __init__(self):
+        self.term_column = array('I')
+        # position of the document in the batch
+        self.position_column = array('I')
+        self.occurrence_column = array('I')
+        self.documents = array('I')
+        self.max_freqs = array('I')
+        self.doc_lengths = array('I')
+
+    def add_document(self, doc_id, term_ids, occurrences, max_freq):
+        self.position_column.extend([len(self.documents)] * len(term_ids))
+        self.term_column.extend(term_ids)
+        self.occurrence_column.extend(occurrences)
+        self.documents.append(doc_id)
+        self.max_freqs.append(max_freq)
+        self.doc_lengths.append(len(term_ids))
+
+    def group(self, terms):
+        # Sorts the postings by term id, terms: word of each term id
+        positions = numpy.frombuffer(self.position_column, dtype=numpy.uint32)
+        term_ids = numpy.frombuffer(self.term_column, dtype=numpy.uint32)
+        occurrences = numpy.frombuffer(self.occurrence_column, dtype=numpy.uint32)
+        max_freqs = numpy.frombuffer(self.max_freqs, dtype=numpy.uint32)[positions]
+        # see slide 8, the TF is applied again on its own result for every other occurrence of the word in the
+        # document, like the indexing has always done
+        self.tf_column = 0.5 + 0.5 * occurrences / max_freqs
+        for occurrence in range(2, int(occurrences.max(initial=0)) + 1):
+            repeated = occurrences >= occurrence
+            self.tf_column[repeated] = 0.5 + 0.5 * self.tf_column[repeated] / max_freqs[repeated]
+        order = numpy.argsort(term_ids, kind='stable')
+        self.term_ids, starts = numpy.unique(term_ids[order], return_index=True)
+        self.bounds = numpy.append(starts, len(order)).tolist()
+        # first document of the batch holding each term
+        self.first_positions = positions[order][starts]
+        self.term_documents = numpy.frombuffer(self.documents, dtype=numpy.uint32)[positions[order]]
+        self.term_tfs = self.tf_column[order]
+        self.group_of = {terms[term_id]: i for i, term_id in enumerate(self.term_ids.tolist())}
+
+    def postings(self, word):
+        # Documents and TF of the word in the batch, sorted by document
+        i = self.group_of[word]
+        start, end = self.bounds[i], self.bounds[i + 1]
+        return self.term_documents[start:end], self.term_tfs[start:end]
+
+    def __contains__(self, word):
+        return word in self.group_of
+
+    def __iter__(self):
+        return iter(self.group_of)
+
+    def __len__(self):
+        return len(self.group_of)
@@ -0,0 +1,263 @@
+"""
+Reproducible benchmark of the indexing and of the queries. A synthetic corpus in the LA Times format is generated from
+a seed (or an existing folder is used), indexed in its own process, then fixed query workloads drawn from the
+vocabulary of the index are run in another process. The report gives the throughput, the latency percentiles, the
+peak RSS and the size of the index as JSON, and can be compared with a previous report.
+
+Usage example: python3 benchmark/suite.py --files 20 --docs 200 --output report.json --baseline previous.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import Index  # noqa: E402
+from search import Searcher  # noqa: E402
+import text_preprocessing  # noqa: E402
+
+SYLLABLES = ['ba', 'ko', 'ri', 'ne', 'tu', 'sa', 'mi', 'lo', 'de', 'fa', 'gu', 'pe', 'zi', 'ho', 'va', 'ly', 'cho',
+             'tra', 'ven', 'mor', 'pal', 'sen', 'dor', 'kin']
+WORKLOADS = ['single_term', 'disjunctive', 'conjunctive', 'fagins', 'top_k', 'wand', 'knn', 'similar_word']
+
+
+def synthetic_vocabulary(rng, size):
+    # Distinct words of 2 to 4 syllables, the rank of a word is its position in the list
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def generate_corpus(folder, files, docs_per_file, words_per_doc, vocabulary_size, seed, zipf=1.1):
+    # Articles in the format of the LA Times files, the words of the texts follow a Zipf law
+    rng = numpy.random.default_rng(seed)
+    vocabulary = numpy.array(synthetic_vocabulary(rng, vocabulary_size))
+    probabilities = 1 / numpy.arange(1, vocabulary_size + 1) ** zipf
+    probabilities /= probabilities.sum()
+    os.makedirs(folder, exist_ok=True)
+    for file_number in range(files):
+        with open(os.path.join(folder, 'la{:06d}'.format(file_number)), 'w') as f:
+            for doc_number in range(1, docs_per_file + 1):
+                length = max(10, int(rng.lognormal(numpy.log(words_per_doc), 0.5)))
+                words = vocabulary[rng.choice(vocabulary_size, size=length, p=probabilities)]
+                paragraphs = [" ".join(words[i:i + 60]) for i in range(8, length, 60)]
+                f.write("<DOC>\n<DOCNO> LA{:06d}-{:04d} </DOCNO>\n<DOCID> {} </DOCID>\n"
+                        .format(file_number, doc_number, doc_number))
+                f.write("<HEADLINE>\n<P>\n{}\n</P>\n</HEADLINE>\n".format(" ".join(words[:8]).upper()))
+                f.write("<TEXT>\n" + "".join("<P>\n{}\n</P>\n".format(p) for p in paragraphs) + "</TEXT>\n</DOC>\n")
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def open_index(args, path, load):
+    line_filters = text_preprocessing.get_instances_of_all_line_preparators(stopwords=args.stopwords)
+    word_filters = text_preprocessing.get_instances_of_all_word_preparators(stemming=args.stem)
+    return Index(path, line_filters, word_filters, load, verbose=False, score_bits=args.compress,
+                 impact=args.impact, segmented=args.segments, positional=args.positions)
+
+
+def run_indexing(args, corpus, path, queue):
+    index = open_index(args, path, False)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        index.index_folder(corpus, args.batch, spimi=args.spimi, workers=args.workers)
+    seconds = time.perf_counter() - start
+    directory, name = os.path.split(path)
+    files = {f: os.path.getsize(os.path.join(directory, f)) for f in sorted(os.listdir(directory))
+             if f.startswith(name)}
+    queue.put({
+        'seconds': seconds,
+        'documents': index.docs_indexed,
+        'documents_per_second': index.docs_indexed / seconds,
+        'vocabulary': len(index.voc),
+        'peak_rss_mb': peak_rss_mb(),
+        'workers_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'index_bytes': sum(files.values()),
+        'index_files': files,
+    })
+
+
+def make_workloads(index, queries, seed, k):
+    # Fixed queries drawn from the vocabulary sorted by decreasing DF, so the same corpus gives the same queries
+    rng = numpy.random.default_rng(seed)
+    words = sorted(index.voc, key=lambda w: (-index.count[w][0], w))
+    common = words[:max(1, len(words) // 100)]
+    middle = words[len(words) // 100:max(len(words) // 100 + 1, len(words) // 5)]
+    documents = sorted(index.forward_voc)
+
+    def pick(pool, n):
+        return [str(w) for w in rng.choice(pool, size=n)]
+    # the same disjunctive top k queries for the naive approach and Block-Max WAND
+    top_k = [(" ".join(pick(common, 2) + pick(middle, 1)), k) for _ in range(queries)]
+    return {
+        'single_term': [(w,) for w in pick(middle, queries)],
+        'disjunctive': [(" ".join(pick(middle, 3)),) for _ in range(queries)],
+        'conjunctive': [("&".join(pick(common, 1) + pick(middle, 1)),) for _ in range(queries)],
+        'fagins': [(" ".join(pick(common, 2)), k) for _ in range(queries)],
+        'top_k': top_k,
+        'wand': top_k,
+        'knn': [(int(d), k) for d in rng.choice(documents, size=queries)] if documents else [],
+        'similar_word': [(w, k) for w in pick(middle, queries)],
+    }
+
+
+def run_queries(args, path, queue):
+    index = open_index(args, path, True)
+    # the result cache would answer the repeated queries
+    searcher = Searcher(index, cache_size=0)
+    methods = {
+        'single_term': lambda query: searcher.search(query, False),
+        'disjunctive': lambda query: searcher.search(query, False),
+        'conjunctive': lambda query: searcher.search(query, False),
+        'fagins': lambda query, k: searcher.search_fagins(query, k, False),
+        'top_k': lambda query, k: searcher.search(query, False, k),
+        'wand': lambda query, k: searcher.search_wand(query, k, False),
+        'knn': lambda doc, k: searcher.knn(doc, k, False),
+        'similar_word': lambda word, k: searcher.similar_words(word, k),
+    }
+    report = {}
+    for name, queries in make_workloads(index, args.queries, args.seed, args.k).items():
+        if name not in args.workloads or not queries:
+            continue
+        # the latency of a query is its fastest run, the later runs read the posting lists from the cache
+        latencies = numpy.full(len(queries), numpy.inf)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.repeat):
+                for i, query in enumerate(queries):
+                    start = time.perf_counter()
+                    methods[name](*query)
+                    latencies[i] = min(latencies[i], time.perf_counter() - start)
+        latencies = latencies * 1000
+        report[name] = {
+            'queries': len(queries),
+            'queries_per_second': len(queries) / (latencies.sum() / 1000),
+            'mean_ms': float(latencies.mean()),
+            'p50_ms': float(numpy.percentile(latencies, 50)),
+            'p95_ms': float(numpy.percentile(latencies, 95)),
+            'p99_ms': float(numpy.percentile(latencies, 99)),
+            'max_ms': float(latencies.max()),
+        }
+    queue.put({'workloads': report, 'peak_rss_mb': peak_rss_mb()})
+
+
+def in_process(target, *args):
+    # Each phase runs in its own process, so its peak RSS is its own
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (queue,))
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            if not process.is_alive():
+                raise RuntimeError("{} failed with exit code {}".format(target.__name__, process.exitcode))
+    process.join()
+    return result
+
+
+def compare(report, baseline, tolerance):
+    # Prints the times of the baseline and of the report, returns those more than tolerance above the baseline
+    regressions = []
+    pairs = [('indexing.seconds', report['indexing']['seconds'], baseline['indexing']['seconds'])]
+    for name, workload in report['queries']['workloads'].items():
+        previous = baseline['queries']['workloads'].get(name)
+        if previous is not None:
+            pairs += [('queries.{}.{}'.format(name, metric), workload[metric], previous[metric])
+                      for metric in ('p50_ms', 'p95_ms', 'p99_ms')]
+    for metric, value, previous in pairs:
+        ratio = value / previous if previous else 1
+        print("{:<40} {:>12.3f} {:>12.3f} {:>+8.1%}".format(metric, previous, value, ratio - 1))
+        if ratio > 1 + tolerance:
+            regressions.append(metric)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the indexing and of the queries')
+    parser.add_argument('--corpus', default=None, help='Folder of LA Times files to use instead of a synthetic one')
+    parser.add_argument('--files', type=int, default=20, help='Number of files of the synthetic corpus')
+    parser.add_argument('--docs', type=int, default=200, help='Number of documents of each synthetic file')
+    parser.add_argument('--words', type=int, default=250, help='Median number of words of a synthetic document')
+    parser.add_argument('--vocabulary', type=int, default=30000, help='Number of words of the synthetic corpus')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the corpus and of the queries')
+    parser.add_argument('--queries', type=int, default=200, help='Number of queries of each workload')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of runs of each workload, the fastest counts')
+    parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument('-k', type=int, default=10, help='k of the top k queries')
+    parser.add_argument('-b', '--batch', type=int, default=10)
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    parser.add_argument('-s', '--stopwords', action='store_true')
+    parser.add_argument('--stem', action='store_true')
+    parser.add_argument('--spimi', action='store_true')
+    parser.add_argument('--compress', type=int, choices=[8, 16], default=None)
+    parser.add_argument('--impact', action='store_true')
+    parser.add_argument('--segments', action='store_true')
+    parser.add_argument('--positions', action='store_true')
+    parser.add_argument('--work-dir', default=None, help='Folder of the corpus and index, a temporary one by default')
+    parser.add_argument('--output', default=None, help='Path of the JSON report, printed by default')
+    parser.add_argument('--baseline', default=None, help='Previous JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown over the baseline reported as a regression (0.2 by default)')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='text-indexing-benchmark-')
+    try:
+        corpus = args.corpus
+        if corpus is None:
+            corpus = os.path.join(work_dir, 'corpus')
+            generate_corpus(corpus, args.files, args.docs, args.words, args.vocabulary, args.seed)
+        os.makedirs(os.path.join(work_dir, 'index'), exist_ok=True)
+        path = os.path.join(work_dir, 'index', 'pl')
+        report = {
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+            'environment': {'python': platform.python_version(), 'numpy': numpy.__version__,
+                            'platform': platform.platform(), 'cpus': os.cpu_count()},
+            'corpus': {'files': len(os.listdir(corpus)), 'bytes': folder_size(corpus)},
+            'indexing': in_process(run_indexing, args, os.path.join(corpus, ''), path),
+            'queries': in_process(run_queries, args, path),
+        }
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
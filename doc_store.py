@@ -0,0 +1,81 @@
+import mmap
+import os
+import numpy
+
+# Rows are appended in the order of indexing, so they are sorted by document id
+DOC_ROW = numpy.dtype([('document', '<u4'), ('offset', '<u8'), ('length', '<u4'), ('title_offset', '<u8'),
+                       ('title_length', '<u4')])
+
+
+class DocumentStore:
+    """
+    Location of the article of every indexed document in its source file, and its title.
+    The fixed-width rows are in `path`, the UTF-8 titles one after the other in `path+'_titles'`: finding a document
+    is a binary search on the memory-mapped rows, reading it is a single seek in its source file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.titles_path = path + '_titles'
+        # Source file of each file index (document id // 10**6)
+        self.files = []
+        self.__new_rows = []
+        self.__new_titles = bytearray()
+        self.__titles_size = 0
+        self.__rows = None
+        self.__titles_map = None
+
+    def clear(self):
+        # A new index must not append to the store of an older one
+        self.close()
+        for path in (self.path, self.titles_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.files = []
+
+    def set_files(self, first_file_index, files):
+        self.files = self.files[:first_file_index] + list(files)
+
+    def add(self, doc_id, offset, length, title):
+        if not self.__new_rows:
+            self.__titles_size = os.path.getsize(self.titles_path) if os.path.exists(self.titles_path) else 0
+        encoded = title.encode('utf-8')
+        self.__new_rows.append((doc_id, offset, length, self.__titles_size + len(self.__new_titles), len(encoded)))
+        self.__new_titles += encoded
+
+    def save_to_disk(self):
+        if not self.__new_rows:
+            return
+        with open(self.path, 'ab') as out:
+            out.write(numpy.array(self.__new_rows, dtype=DOC_ROW).tobytes())
+        with open(self.titles_path, 'ab') as out:
+            out.write(self.__new_titles)
+        self.__new_rows = []
+        self.__new_titles = bytearray()
+        # the maps do not see the appended rows
+        self.close()
+
+    def close(self):
+        self.__rows = None
+        self.__titles_map = None
+
+    def open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return False
+        if self.__rows is None:
+            self.__rows = numpy.memmap(self.path, dtype=DOC_ROW, mode='r')
+            with open(self.titles_path, 'rb') as f:
+                self.__titles_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                    if os.path.getsize(self.titles_path) > 0 else b''
+        return True
+
+    def find(self, doc_id):
+        # (source file, offset, length, title) of the document, None if it is not in the store
+        file_index = doc_id // 10 ** 6
+        if file_index >= len(self.files) or not self.open():
+            return None
+        row = int(numpy.searchsorted(self.__rows['document'], doc_id))
+        if row == len(self.__rows) or self.__rows[row]['document'] != doc_id:
+            return None
+        document, offset, length, title_offset, title_length = self.__rows[row].tolist()
+        title = self.__titles_map[title_offset:title_offset + title_length].decode('utf-8')
+        return self.files[file_index], offset, length, title
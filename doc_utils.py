@@ -17,48 +17,75 @@ def get_element_inner_text(element, xpath):
     return "".join(found.itertext())
 
 
-def file_to_xml(file_path):
-    with open(file_path, "r") as file:
-        text = ""
-        for line in file:
-            text += line
-        text = "<DOCCOLLECTION>" + text + "</DOCCOLLECTION>"
-        return ElTree.fromstring(text)
+DOC_START = b'<DOC>'
+DOC_END = b'</DOC>'
 
 
-def extract_data(raw_document_path, files_indexed):
-    texts = {}
-    try:
-        docs = file_to_xml(raw_document_path)
-    except ElTree.ParseError:
-        return texts
+def iter_articles(file_path, chunk_size=1 << 16):
+    # Yields (byte offset, byte length, DOC element) for each article of the file, the file is read by chunks and
+    # only the current article is parsed
+    with open(file_path, 'rb') as file:
+        buffer = b''
+        buffer_offset = 0
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            buffer += chunk
+            start = 0
+            end = buffer.find(DOC_END, start)
+            while end >= 0:
+                end += len(DOC_END)
+                begin = buffer.find(DOC_START, start, end)
+                if begin < 0:
+                    raise ElTree.ParseError("{} closed at byte {} was never opened"
+                                            .format(DOC_END, buffer_offset + end))
+                yield buffer_offset + begin, end - begin, ElTree.fromstring(buffer[begin:end])
+                start = end
+                end = buffer.find(DOC_END, start)
+            buffer = buffer[start:]
+            buffer_offset += start
+
+
+def read_article(file_path, offset, length):
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        return ElTree.fromstring(file.read(length))
+
+
+def article_doc_id(article, files_indexed):
+    return int(article.find('./DOCID').text.strip()) + (files_indexed * (10 ** 6))
+
 
-    articles_indexed = 0
-    for article in docs:
-        doc_id = int(article.find('./DOCID').text.strip()) + (files_indexed * (10 ** 6))
+def article_text(article):
+    return get_element_inner_text(article, './HEADLINE') + '\n' \
+        + get_element_inner_text(article, './BYLINE') + '\n' \
+        + get_element_inner_text(article, './TEXT') + '\n' \
+        + get_element_inner_text(article, './SUBJECT') + '\n' \
+        + get_element_inner_text(article, './GRAPHIC') + '\n'
 
-        # print("Adding document {} from file {} to index".format(doc_id, filename))
-        important_stuff = get_element_inner_text(article, './HEADLINE') + '\n' \
-                          + get_element_inner_text(article, './BYLINE') + '\n' \
-                          + get_element_inner_text(article, './TEXT') + '\n' \
-                          + get_element_inner_text(article, './SUBJECT') + '\n' \
-                          + get_element_inner_text(article, './GRAPHIC') + '\n'
 
-        # Lowercase as early as possible, reduces amount of calls
-        # important_stuff = important_stuff.lower()
-        texts[doc_id] = important_stuff
-        articles_indexed += 1
-    return texts
+def article_title(article):
+    return get_element_inner_text(article, './HEADLINE').strip().title()
+
+
+def iter_documents(raw_document_path, files_indexed):
+    # Yields (doc_id, text) for each article of the file, stops at the first malformed one
+    try:
+        for _, _, article in iter_articles(raw_document_path):
+            yield article_doc_id(article, files_indexed), article_text(article)
+    except ElTree.ParseError:
+        return
 
 
 def title_of_doc(doc_no, file_path, complete=False, max_char=60, pad=False):
-    tree = file_to_xml(file_path)
     title = str(doc_no)
-    for article in tree:
-        if int(article.find('./DOCID').text.strip()) != doc_no:
+    for _, _, article in iter_articles(file_path):
+        if article_doc_id(article, 0) != doc_no:
             continue
-        title = get_element_inner_text(article, './HEADLINE').strip().title()
+        title = article_title(article)
         break
+    return format_title(title, complete, max_char, pad)
+
+
+def format_title(title, complete=False, max_char=60, pad=False):
     newline_array = title.split('\n')
     title = newline_array[0]
     if complete:
@@ -94,6 +121,14 @@ class Reader:
         return biggest_matching['name'], file_index, article_id
 
     def get_doc_title(self, doc_id):
+        with self.index.metrics.stage('query.title'):
+            return self.find_doc_title(doc_id)
+
+    def find_doc_title(self, doc_id):
+        location = self.index.documents.find(doc_id)
+        if location is not None:
+            return format_title(location[3], pad=True)
+        # Indexes saved without the document store
         folder_name, file_index, doc_id = self.split_file_doc_id(doc_id)
 
         files = get_indexable_filenames(folder_name)
@@ -101,9 +136,14 @@ class Reader:
         return title_of_doc(doc_id, files[file_index], pad=True)
 
     def read_doc(self, doc_id):
+        location = self.index.documents.find(doc_id)
+        if location is not None:
+            return article_text(read_article(*location[:3]))
         folder_name, file_index, doc_id = self.split_file_doc_id(doc_id)
 
         files = get_indexable_filenames(folder_name)
 
-        arr = extract_data(files[file_index], 0)
-        return arr[doc_id]
+        for article_id, text in iter_documents(files[file_index], 0):
+            if article_id == doc_id:
+                return text
+        raise KeyError(doc_id)
@@ -1,32 +1,116 @@
 import io
-from collections import OrderedDict
+from collections import Counter, OrderedDict
+import heapq
+import mmap
+import multiprocessing
 import struct
 import os
 import math
 import numpy
 import statistics
+import time
+from xml.etree.ElementTree import ParseError
 import pickle
 from timer import Timer
 import terminal
+import text_preprocessing
+from batch_postings import BatchPostings
 import doc_utils
+import doc_store
+import index_stats
+import metrics
+import pl_cache
+import pl_compression
+import term_dictionary
+import voc_tables
+
+
+# A row of the posting list: document id and score, big-endian like the '!If' struct format
+PL_ROW = numpy.dtype([('document', '>u4'), ('score', '>f4')])
+# A row of the forward index: id of a word of the document and its term frequency
+FORWARD_ROW = numpy.dtype([('term', '>u4'), ('tf', '>f4')])
+# Number of rows of a posting list sharing a maximum score, for the Block-Max WAND search
+BLOCK_SIZE = 128
 
 
 class Index:
-    def __init__(self, path, line_preparation, word_preparation, load=False, verbose=True):
+    def __init__(self, path, line_preparation, word_preparation, load=False, verbose=True, score_bits=None,
+                 impact=False, segmented=False, pl_cache_size=64 * 2 ** 20, positional=False):
 
         self.docs_indexed = 0
+        # Incremented every time the indexed documents change, cached query results of older generations are stale
+        self.generation = 0
         # In-memory representation of the posting list
         self.__binary_pl = io.BytesIO(b"")
+        # Read-only memory map of the posting list file, opened on the first read
+        self.__pl_map = None
+        # Timings of the stages of the indexing and of the queries
+        self.metrics = metrics.Metrics()
+        # Most recently read posting lists, up to pl_cache_size bytes
+        self.pl_cache = pl_cache.PostingListCache(pl_cache_size)
+        # Copy of the posting lists sorted by decreasing score, for the top k algorithms
+        self.impact = impact
+        self.impact_voc = {}
+        self.__new_impact_voc = {}
+        self.__impact_offset = 0
+        self.__binary_impact = io.BytesIO(b"")
+        self.__impact_map = None
         self.voc = {}
+        # word -> (number of docs, idf, maximum score)
         self.count = {}
-        self.index_vectors = {}
-        self.context_vectors = {}
+        # word -> maximum score of each block of BLOCK_SIZE rows, for the posting lists longer than one block
+        self.block_max = {}
+        # word -> term id, and term id -> word
+        self.term_ids = {}
+        self.terms = []
+        # Forward index, appended after each batch: doc_id -> (length, offset) of the words of the doc
+        self.forward_voc = {}
+        self.__binary_forward = io.BytesIO(b"")
+        self.__forward_map = None
+        self.__forward_offset = 0
+        # Positions of the words of each doc, in a separate file only read by the phrase queries:
+        # doc_id -> (length, offset)
+        self.positional = positional
+        self.positions_voc = {}
+        self.__binary_positions = io.BytesIO(b"")
+        self.__positions_map = None
+        self.__positions_offset = 0
+        # Location in its source file and title of each document
+        self.documents = doc_store.DocumentStore(path + '_docs')
         self.vectors_size = 200
+        # Random index vector of each doc: 3 positions set to 1 then 3 positions set to -1, in the order of indexing
+        self.index_vectors = numpy.empty((0, 6), dtype=numpy.int16)
+        self.index_vector_docs = numpy.empty(0, dtype=numpy.uint32)
+        # Normalized context vector of each word, indexed by term id (only the first len(self.terms) rows are used)
+        self.context_vectors = numpy.zeros((0, self.vectors_size), dtype=numpy.float32)
         self.path = path
         self.voc_path = path + '_voc'
+        self.impact_path = path + '_impact'
+        self.forward_path = path + '_fwd'
+        self.positions_path = path + '_pos'
+        self.dictionary_path = path + '_dict'
+        # block_max, forward_voc and positions_voc, as fixed-width tables
+        self.block_max_path = path + '_block_max.npy'
+        self.block_max_offsets_path = path + '_block_max_offsets.npy'
+        self.forward_voc_path = path + '_fwd_voc.npy'
+        self.positions_voc_path = path + '_pos_voc.npy'
         self.line_filters = line_preparation
         self.word_filters = word_preparation
+        self.tokenizer = text_preprocessing.Tokenizer(line_preparation, word_preparation)
         self.directories = []
+        # With segments, each indexed folder gets its own posting lists, holding the TF, in an immutable segment
+        self.segmented = segmented
+        self.segments = []
+        self.segments_created = 0
+        self.__segment_indexes = {}
+        # word -> maximum TF over the segments
+        self.max_tf = {}
+        # True for the Index of a segment
+        self.is_segment = False
+        # None keeps the uncompressed posting list, 8 or 16 quantize the scores and compress the document ids
+        self.score_bits = score_bits
+        self.pl_version = pl_compression.RAW_FORMAT_VERSION if score_bits is None\
+            else pl_compression.COMPRESSED_FORMAT_VERSION
         if load:
             timer = Timer()
             timer.start()
@@ -37,28 +121,85 @@ class Index:
                 print("Loaded saved data in {}s {}ms".format(tuple_time[1], tuple_time[2]))
 
     def save_voc(self):
+        self.save_dictionary()
+        Index.save_array(self.path + '_index_vectors.npy', self.index_vectors)
+        Index.save_array(self.path + '_index_vector_docs.npy', self.index_vector_docs)
+        Index.save_array(self.path + '_context_vectors.npy', self.context_vectors[:len(self.terms)])
+        self.save_voc_tables()
         with open(self.voc_path, 'wb') as f:
             data = {
                 'docs_indexed': self.docs_indexed,
-                'count': self.count,
-                'voc': self.voc,
-                'index_vectors': self.index_vectors,
-                'context_vectors': self.context_vectors,
-                'dirs': self.directories
+                'positional': self.positional,
+                'document_files': self.documents.files,
+                'dirs': self.directories,
+                'pl_format': {'version': self.pl_version, 'score_bits': self.score_bits},
+                'impact': self.impact,
+                'segments': {'paths': self.segments, 'created': self.segments_created} if self.segmented else None,
+                'dictionary_version': term_dictionary.VERSION
             }
             pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
 
+    def save_dictionary(self):
+        for w in self.voc:
+            self.get_term_id(w)
+        words = sorted(self.voc)
+        row_of = {w: row for row, w in enumerate(words)}
+        entries = []
+        for w in words:
+            pl_len, pl_offset = self.voc[w]
+            impact_len, impact_offset = self.impact_voc.get(w, (0, 0))
+            entries.append((w, (pl_offset, pl_len, self.count[w][0], self.count[w][1], self.get_max_score(w),
+                                self.term_ids[w], impact_len, impact_offset)))
+        term_dictionary.TermDictionary.write(self.dictionary_path, entries,
+                                             [row_of.get(w, 0) for w in self.terms])
+
+    def save_voc_tables(self):
+        block_max_offsets, block_max = voc_tables.term_arrays(self.block_max, self.term_ids, len(self.terms))
+        Index.save_array(self.block_max_offsets_path, block_max_offsets)
+        Index.save_array(self.block_max_path, block_max)
+        Index.save_array(self.forward_voc_path, voc_tables.document_entries(self.forward_voc))
+        Index.save_array(self.positions_voc_path, voc_tables.document_entries(self.positions_voc))
+
+    @staticmethod
+    def save_array(path, array):
+        # The saved array may be memory-mapped by this index, so the file is replaced instead of overwritten
+        with open(path + '_temp', 'wb') as f:
+            numpy.save(f, array)
+        os.replace(path + '_temp', path)
+
     def load_voc(self):
         try:
             with open(self.voc_path, 'rb') as f:
                 data = pickle.load(f)
                 try:
-                    self.count = data['count']
-                    self.voc = data['voc']
+                    if 'voc' in data:
+                        self.load_pickled_voc(data)
+                    else:
+                        self.load_dictionary()
+                        self.index_vectors = numpy.load(self.path + '_index_vectors.npy', mmap_mode='r')
+                        self.index_vector_docs = numpy.load(self.path + '_index_vector_docs.npy', mmap_mode='r')
+                        self.context_vectors = numpy.load(self.path + '_context_vectors.npy', mmap_mode='r')
+                        self.impact = data['impact']
                     self.directories = data['dirs']
                     self.docs_indexed = data['docs_indexed']
-                    self.index_vectors = data['index_vectors']
-                    self.context_vectors = data['context_vectors']
+                    if 'voc' in data or 'forward_voc' in data:
+                        # indexes saved before the tables kept them in the pickle
+                        self.block_max = data.get('block_max', {})
+                        self.forward_voc = data.get('forward_voc', {})
+                        self.positions_voc = data.get('positions_voc', {})
+                    else:
+                        self.load_voc_tables()
+                    self.positional = data.get('positional', False)
+                    self.documents.files = data.get('document_files', [])
+                    # The saved posting list keeps its format, whatever was asked for this run
+                    pl_format = data.get('pl_format', {'version': pl_compression.RAW_FORMAT_VERSION,
+                                                       'score_bits': None})
+                    self.pl_version = pl_format['version']
+                    self.score_bits = pl_format['score_bits']
+                    if data.get('segments') is not None:
+                        self.segmented = True
+                        self.segments = data['segments']['paths']
+                        self.segments_created = data['segments']['created']
                 except KeyError:
                     print("Your index file data version is too low. Loading failed.")
                     return
@@ -66,6 +207,105 @@ class Index:
             print("File not found. Starting with an empty index")
             return
 
+    def load_pickled_voc(self, data):
+        # Indexes saved before the term dictionary kept the whole vocabulary in the pickle
+        self.count = data['count']
+        self.voc = data['voc']
+        self.terms = data.get('terms', [])
+        self.term_ids = {w: term_id for term_id, w in enumerate(self.terms)}
+        self.load_vectors(data['index_vectors'], data.get('index_vector_docs'), data['context_vectors'])
+        if data.get('impact_voc') is not None:
+            self.impact = True
+            self.impact_voc = data['impact_voc']
+
+    def load_dictionary(self):
+        # The vocabulary stays on the disk and is read through read-only views until the next indexing
+        dictionary = term_dictionary.TermDictionary(self.dictionary_path)
+        self.voc = term_dictionary.DictionaryView(dictionary, ('length', 'offset'))
+        self.count = term_dictionary.DictionaryView(dictionary, ('df', 'idf', 'max_score'))
+        self.impact_voc = term_dictionary.DictionaryView(dictionary, ('impact_length', 'impact_offset'),
+                                                         mask_field='impact_length')
+        self.term_ids = term_dictionary.DictionaryView(dictionary, ('term_id',))
+        self.terms = term_dictionary.TermsView(dictionary)
+
+    def load_voc_tables(self):
+        # Read through memory maps until the next indexing, like the term dictionary
+        self.block_max = voc_tables.TermArraysView(self.term_ids, self.terms,
+                                                   numpy.load(self.block_max_offsets_path, mmap_mode='r'),
+                                                   numpy.load(self.block_max_path, mmap_mode='r'))
+        self.forward_voc = voc_tables.DocumentEntriesView(numpy.load(self.forward_voc_path, mmap_mode='r'))
+        self.positions_voc = voc_tables.DocumentEntriesView(numpy.load(self.positions_voc_path, mmap_mode='r'))
+
+    def load_dictionary_in_memory(self):
+        # Indexing updates the vocabulary and the vectors, they are read from the disk into dicts and arrays
+        if isinstance(self.voc, term_dictionary.DictionaryView):
+            dictionary = self.voc.dictionary
+            words = list(dictionary)
+            rows = dictionary.rows
+            self.voc = dict(zip(words, zip(rows['length'].tolist(), rows['offset'].tolist())))
+            self.count = dict(zip(words, zip(rows['df'].tolist(), rows['idf'].tolist(),
+                                             rows['max_score'].tolist())))
+            self.impact_voc = {w: (impact_len, impact_offset) for w, impact_len, impact_offset
+                               in zip(words, rows['impact_length'].tolist(), rows['impact_offset'].tolist())
+                               if impact_len != 0}
+            self.terms = [words[row] for row in dictionary.id_to_row.tolist()]
+            self.term_ids = {w: term_id for term_id, w in enumerate(self.terms)}
+            if self.segmented:
+                self.max_tf = {}
+                for segment in self.get_segments():
+                    segment_dictionary = segment.count.dictionary
+                    for w, tf in zip(segment_dictionary, segment_dictionary.rows['max_score'].tolist()):
+                        self.max_tf[w] = max(tf, self.max_tf.get(w, tf))
+        if isinstance(self.block_max, voc_tables.TermArraysView):
+            self.block_max = {w: numpy.array(blocks) for w, blocks in self.block_max.items()}
+        for name in ('forward_voc', 'positions_voc'):
+            entries = getattr(self, name)
+            if isinstance(entries, voc_tables.DocumentEntriesView):
+                setattr(self, name, dict(zip(entries.rows['document'].tolist(),
+                                             zip(entries.rows['length'].tolist(), entries.rows['offset'].tolist()))))
+        self.index_vectors = numpy.array(self.index_vectors)
+        self.index_vector_docs = numpy.array(self.index_vector_docs)
+        self.context_vectors = numpy.array(self.context_vectors)
+
+    def load_vectors(self, index_vectors, index_vector_docs, context_vectors):
+        if not isinstance(context_vectors, dict):
+            self.index_vectors = index_vectors
+            self.index_vector_docs = index_vector_docs
+            self.context_vectors = context_vectors
+            return
+        # Older indexes kept one dense vector per doc and per word
+        sparse_vectors = []
+        for vect in index_vectors.values():
+            positives = list(numpy.flatnonzero(vect > 0))
+            negatives = list(numpy.flatnonzero(vect < 0))
+            # Repeating a position keeps the same vector, -1 are set last so they can pad the positions set to 1
+            sparse_vectors.append((positives + negatives * 3)[:3] + (negatives * 3)[:3])
+        self.index_vectors = numpy.array(sparse_vectors, dtype=numpy.int16).reshape(-1, 6)
+        self.index_vector_docs = numpy.array(list(index_vectors.keys()), dtype=numpy.uint32)
+        self.context_vectors = numpy.zeros((len(context_vectors), self.vectors_size), dtype=numpy.float32)
+        for w, vect in context_vectors.items():
+            self.context_vectors[self.get_term_id(w)] = vect
+
+    def add_context_vectors(self, term_ids, index_vectors, chunk_size=10000):
+        # Adds the index vector of a doc to the context vector of each word, then normalizes them
+        needed = len(self.terms)
+        if needed > len(self.context_vectors):
+            grown = numpy.zeros((max(needed, 2 * len(self.context_vectors)), self.vectors_size), dtype=numpy.float32)
+            grown[:len(self.context_vectors)] = self.context_vectors
+            self.context_vectors = grown
+        term_ids = numpy.asarray(term_ids, dtype=numpy.int64)
+        for start in range(0, len(term_ids), chunk_size):
+            ids = term_ids[start:start + chunk_size]
+            positions = index_vectors[start:start + chunk_size].astype(numpy.int64)
+            rows = numpy.arange(len(ids))[:, None]
+            vectors = numpy.zeros((len(ids), self.vectors_size), dtype=numpy.float32)
+            vectors[rows, positions[:, :3]] = 1
+            vectors[rows, positions[:, 3:]] = -1
+            context = self.context_vectors[ids] + vectors
+            norms = numpy.linalg.norm(context, axis=1)
+            norms[norms == 0] = 1
+            self.context_vectors[ids] = context / norms[:, None]
+
     @staticmethod
     def term_frequency(count_doc_occurrences, max_freq):
         # see slide 8
@@ -75,26 +315,200 @@ class Index:
         return 0.5 + 0.5 * count_doc_occurrences / max_freq
 
     @staticmethod
-    def read_pl_for_word(pl_len, pl_offset, path, pl_row_len=8):
-        pl = OrderedDict()
+    def map_file(path):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
         with open(path, 'rb') as pl_file:
-            pl_file.seek(pl_offset)
-            while pl_file.tell() < pl_offset + pl_len:
-                byte_row = pl_file.read(pl_row_len)
-                pl_struct = struct.unpack('!If', byte_row)
-                pl.update({pl_struct[0]: pl_struct[1]})
-        return pl
+            return mmap.mmap(pl_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get_pl_map(self):
+        if self.__pl_map is None:
+            self.__pl_map = Index.map_file(self.path)
+        return self.__pl_map
+
+    def get_impact_map(self):
+        if self.__impact_map is None:
+            self.__impact_map = Index.map_file(self.impact_path)
+        return self.__impact_map
+
+    def close_pl_map(self):
+        # Arrays returned by get_pl_array may still point to the maps, so we let the GC unmap them
+        self.__pl_map = None
+        self.__impact_map = None
+        self.pl_cache.clear()
+
+    def get_pl_array(self, word):
+        # Read-only posting list of the word with 'document' and 'score' fields
+        with self.metrics.stage('query.read_pl'):
+            rows = self.pl_cache.get(word)
+            if rows is None:
+                rows = self.read_pl_array(word)
+                self.pl_cache.put(word, rows)
+        return rows
+
+    def read_pl_array(self, word):
+        # Posting list of the word read from the disk, a zero-copy view if not compressed
+        if self.segmented:
+            return self.get_segments_pl(word, lambda segment: segment.get_pl_array(word))
+        pl_map = self.get_pl_map() if word in self.voc else None
+        if pl_map is None:
+            return numpy.empty(0, dtype=PL_ROW)
+        pl_len, pl_offset = self.voc[word]
+        if self.pl_version == pl_compression.RAW_FORMAT_VERSION:
+            return numpy.frombuffer(pl_map, dtype=PL_ROW, count=pl_len // PL_ROW.itemsize, offset=pl_offset)
+        with self.metrics.stage('query.decode_pl'):
+            documents, scores = pl_compression.decode_pl(memoryview(pl_map)[pl_offset:pl_offset + pl_len],
+                                                         self.score_bits)
+            rows = numpy.empty(len(documents), dtype=PL_ROW)
+            rows['document'] = documents
+            rows['score'] = scores
+        return rows
+
+    def get_pl(self, word, cached=True):
+        # Merges read every posting list once, they do not go through the cache
+        rows = self.get_pl_array(word) if cached else self.read_pl_array(word)
+        return OrderedDict(zip(rows['document'].tolist(), rows['score'].tolist()))
+
+    def get_impact_pl(self, word, start=0, stop=None):
+        # Rows start:stop of the posting list sorted by decreasing score, only these rows are read from the disk
+        if self.segmented and self.impact:
+            # the top rows of the segments hold the top rows of the index
+            rows = self.get_segments_pl(word, lambda segment: segment.get_impact_pl(word, 0, stop))
+            return rows[numpy.argsort(-rows['score'], kind='stable')][start:stop]
+        impact_map = self.get_impact_map() if word in self.impact_voc and not self.segmented else None
+        if impact_map is None:
+            return self.get_score_sorted_pl(word)[start:stop]
+        pl_len, pl_offset = self.impact_voc[word]
+        rows_count = pl_len // PL_ROW.itemsize
+        stop = rows_count if stop is None else min(stop, rows_count)
+        start = min(start, stop)
+        return numpy.frombuffer(impact_map, dtype=PL_ROW, count=stop - start,
+                                offset=pl_offset + start * PL_ROW.itemsize)
+
+    def get_score_sorted_pl(self, word):
+        # Without impact posting lists, the posting list is sorted by score once and kept in the cache, so the growing
+        # blocks of the top k algorithms do not sort it again
+        key = ('impact', word)
+        rows = self.pl_cache.get(key)
+        if rows is None:
+            rows = self.get_pl_array(word)
+            with self.metrics.stage('query.sort'):
+                rows = rows[numpy.argsort(-rows['score'], kind='stable')]
+            self.pl_cache.put(key, rows)
+        return rows
+
+    def get_pl_length(self, word):
+        if word in self.impact_voc:
+            return self.impact_voc[word][0] // PL_ROW.itemsize
+        return self.count[word][0] if word in self.count else 0
 
     @staticmethod
-    def read_nth_entry_from_pl(n, pl_offset, path, pl_row_len=8):
-        with open(path, 'rb') as pl_file:
-            pl_file.seek(pl_offset + (n * pl_row_len))
-            byte_row = pl_file.read(pl_row_len)
-            item = struct.unpack('!If', byte_row)
-        return item
-
-    def write_pl_row(self, document, score, path):
-        binary_pack = struct.pack('!If', document, score)
+    def find_scores(rows, documents):
+        # Random access in a posting list sorted by document, NaN for the documents that are not in it
+        documents = numpy.asarray(documents)
+        if len(rows) == 0:
+            return numpy.full(len(documents), numpy.nan)
+        positions = numpy.minimum(numpy.searchsorted(rows['document'], documents), len(rows) - 1)
+        found = rows['document'][positions] == documents
+        return numpy.where(found, rows['score'][positions], numpy.nan)
+
+    def get_term_id(self, word):
+        if word not in self.term_ids:
+            self.term_ids[word] = len(self.terms)
+            self.terms.append(word)
+        return self.term_ids[word]
+
+    def get_forward_entry(self, doc_id):
+        # Rows (term, tf) of the words of the document, None if the document is not in the forward index
+        if doc_id not in self.forward_voc:
+            return None
+        if self.__forward_map is None:
+            self.__forward_map = Index.map_file(self.forward_path)
+        entry_len, entry_offset = self.forward_voc[doc_id]
+        return numpy.frombuffer(self.__forward_map, dtype=FORWARD_ROW, count=entry_len // FORWARD_ROW.itemsize,
+                                offset=entry_offset)
+
+    def write_forward_entries(self, batch):
+        # The postings of the batch are in the order of the documents
+        rows = numpy.empty(len(batch.term_column), dtype=FORWARD_ROW)
+        rows['term'] = batch.term_column
+        rows['tf'] = batch.tf_column
+        offset = self.__forward_offset + self.__binary_forward.tell()
+        for doc_id, length in zip(batch.documents, batch.doc_lengths):
+            self.forward_voc[doc_id] = (length * FORWARD_ROW.itemsize, offset)
+            offset += length * FORWARD_ROW.itemsize
+        self.__binary_forward.write(rows.tobytes())
+
+    def save_forward_to_disk(self):
+        self.__binary_forward.seek(0)
+        with open(self.forward_path, 'ab') as out:
+            out.write(self.__binary_forward.read())
+        self.__forward_offset = os.path.getsize(self.forward_path)
+        self.__binary_forward.close()
+        self.__binary_forward = io.BytesIO(b"")
+        # the map does not see the appended entries
+        self.__forward_map = None
+
+    def write_positions_entry(self, doc_id, term_positions):
+        # Number of positions of each word of the doc, in the order of its forward entry, then the gaps between the
+        # positions of each word
+        values = [len(positions) for positions in term_positions]
+        for positions in term_positions:
+            values.append(positions[0])
+            values.extend([positions[i] - positions[i - 1] for i in range(1, len(positions))])
+        encoded = pl_compression.encode_varints(values)
+        offset = self.__positions_offset + self.__binary_positions.tell()
+        self.__binary_positions.write(encoded)
+        self.positions_voc[doc_id] = (len(encoded), offset)
+
+    def save_positions_to_disk(self):
+        if self.__binary_positions.tell() == 0:
+            return
+        self.__binary_positions.seek(0)
+        with open(self.positions_path, 'ab') as out:
+            out.write(self.__binary_positions.read())
+        self.__positions_offset = os.path.getsize(self.positions_path)
+        self.__binary_positions.close()
+        self.__binary_positions = io.BytesIO(b"")
+        # the map does not see the appended entries
+        self.__positions_map = None
+
+    def get_positions(self, doc_id, term_ids):
+        # term id -> positions of the word in the doc for the given words, None if the positions were not saved
+        forward_entry = self.get_forward_entry(doc_id)
+        if doc_id not in self.positions_voc or forward_entry is None:
+            return None
+        if self.__positions_map is None:
+            self.__positions_map = Index.map_file(self.positions_path)
+        entry_len, entry_offset = self.positions_voc[doc_id]
+        values = pl_compression.decode_varints(memoryview(self.__positions_map)[entry_offset:entry_offset + entry_len])
+        terms = forward_entry['term'].tolist()
+        counts = values[:len(terms)].astype(numpy.int64)
+        starts = len(terms) + numpy.cumsum(counts) - counts
+        positions = {}
+        for term_id in term_ids:
+            if term_id in positions:
+                continue
+            if term_id not in terms:
+                positions[term_id] = []
+                continue
+            i = terms.index(term_id)
+            positions[term_id] = numpy.cumsum(values[starts[i]:starts[i] + counts[i]]).tolist()
+        return positions
+
+    def write_pl(self, word, documents, scores, path):
+        self.save_score_bounds(word, scores)
+        if self.impact:
+            # the impact copy holds the scores read from the posting list, the top k algorithms mix both
+            self.write_impact_pl(word, documents, scores if self.pl_version == pl_compression.RAW_FORMAT_VERSION
+                                 else pl_compression.quantized_scores(scores, self.score_bits))
+        if self.pl_version == pl_compression.RAW_FORMAT_VERSION:
+            rows = numpy.empty(len(documents), dtype=PL_ROW)
+            rows['document'] = documents
+            rows['score'] = scores
+            binary_pack = rows.tobytes()
+        else:
+            binary_pack = pl_compression.encode_pl(documents, scores, self.score_bits)
         self.__binary_pl.write(binary_pack)
         # write PL in memory to disk if it exceeds one MB in size
         if self.__binary_pl.tell() > 1024000:
@@ -102,6 +516,42 @@ class Index:
 
         return len(binary_pack)
 
+    def save_score_bounds(self, word, scores):
+        # Upper bounds of the scores read back from the disk, whether they are rounded to floats or quantized
+        slack = abs(max(scores, key=abs)) * (1e-6 if self.score_bits is None else 1 / ((1 << self.score_bits) - 1))
+        self.count[word] = (self.count[word][0], self.count[word][1], max(scores) + slack)
+        if len(scores) > BLOCK_SIZE:
+            blocks = numpy.maximum.reduceat(numpy.asarray(scores, dtype=numpy.float64),
+                                            numpy.arange(0, len(scores), BLOCK_SIZE))
+            self.block_max[word] = blocks + slack
+        else:
+            self.block_max.pop(word, None)
+
+    def get_max_score(self, word):
+        if len(self.count[word]) < 3:
+            # index saved before the maximum scores were kept
+            rows = self.get_pl_array(word)
+            self.count[word] = (self.count[word][0], self.count[word][1], float(rows['score'].max()))
+        return self.count[word][2]
+
+    def get_block_max(self, word):
+        if self.segmented:
+            scores = self.get_pl_array(word)['score']
+            return numpy.maximum.reduceat(scores, numpy.arange(0, len(scores), BLOCK_SIZE)).astype(numpy.float64)
+        if word in self.block_max:
+            return self.block_max[word]
+        rows_count = self.count[word][0]
+        return numpy.full((rows_count + BLOCK_SIZE - 1) // BLOCK_SIZE, self.get_max_score(word))
+
+    def write_impact_pl(self, word, documents, scores):
+        rows = numpy.empty(len(documents), dtype=PL_ROW)
+        rows['document'] = documents
+        rows['score'] = scores
+        binary_pack = rows[numpy.argsort(-rows['score'], kind='stable')].tobytes()
+        self.__binary_impact.write(binary_pack)
+        self.__new_impact_voc[word] = (len(binary_pack), self.__impact_offset)
+        self.__impact_offset += len(binary_pack)
+
     def save_pl_to_disk(self, path):
         # Open file and read buffer into it
         self.__binary_pl.seek(0)
@@ -109,25 +559,45 @@ class Index:
             out.write(self.__binary_pl.read())
         self.__binary_pl.close()
         self.__binary_pl = io.BytesIO(b"")
+        if self.impact:
+            self.__binary_impact.seek(0)
+            with open(path + '_impact', 'ab') as out:
+                out.write(self.__binary_impact.read())
+            self.__binary_impact.close()
+            self.__binary_impact = io.BytesIO(b"")
 
     def finalize_pl(self, path):
         self.save_pl_to_disk(path)
 
     def finalize_merge_pl(self, temp, path):
         self.save_pl_to_disk(temp)
+        if path == self.path:
+            self.close_pl_map()
         if os.path.exists(path):
             os.remove(path)
         os.rename(temp, path)
-
-    def inverse_document_freq(self, num_where_appeared):
+        if self.impact:
+            if os.path.exists(path + '_impact'):
+                os.remove(path + '_impact')
+            os.rename(temp + '_impact', path + '_impact')
+            self.impact_voc = self.__new_impact_voc
+            self.__new_impact_voc = {}
+            self.__impact_offset = 0
+
+    def inverse_document_freq(self, num_where_appeared, docs_indexed=None):
+        if self.is_segment:
+            # segments keep the TF, the IDF of the whole index is applied when reading them
+            return 1.0
         # see slide 10
-        return math.log10(self.docs_indexed / (1 + num_where_appeared))
+        return math.log10((self.docs_indexed if docs_indexed is None else docs_indexed) / (1 + num_where_appeared))
 
-    def index_folder(self, folder_name, batch_size, progress_bar=False):
+    def index_folder(self, folder_name, batch_size, progress_bar=False, spimi=False, workers=1, shard=None):
         # Open files from specified folder
         timer = Timer()
         timer.start()
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
         try:
+            self.load_dictionary_in_memory()
             prev_index = self.docs_indexed
             # check if folder_name is folder
             if folder_name[-1] != '/':
@@ -139,120 +609,299 @@ class Index:
                 id_offset = len(doc_utils.get_indexable_filenames(self.directories[-1]['name']))\
                             + self.directories[-1]['offset']
             self.directories.append({'name': folder_name, 'offset': id_offset})
+            if len(self.directories) == 1:
+                # new index: the forward index and documents of an older one must not be appended to
+                for path in (self.forward_path, self.positions_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.documents.clear()
+            self.documents.set_files(id_offset, files)
+            self.__forward_offset = os.path.getsize(self.forward_path) if os.path.exists(self.forward_path) else 0
+            self.__positions_offset = os.path.getsize(self.positions_path) \
+                if os.path.exists(self.positions_path) else 0
+
+            # A shard (number, count) only indexes the files whose index is its number modulo the count, the doc
+            # ids stay those of the whole collection
+            file_ids = [id_offset + i for i in range(len(files))]
+            if shard is not None:
+                file_ids = [file_id for file_id in file_ids if file_id % shard[1] == shard[0]]
 
             timer.round()
-            for i in range(0, len(files), batch_size):
-                tfs = self.process_files(files[i:min(i + batch_size, len(files))],
-                                         start_value=id_offset+i, total=len(files) if progress_bar else None)
+            runs = []
+            merge_at_end = spimi or self.segmented
+            for i in range(0, len(file_ids), batch_size):
+                batch_ids = file_ids[i:min(i + batch_size, len(file_ids))]
+                tfs = self.process_files([files[file_id - id_offset] for file_id in batch_ids],
+                                         start_value=i, total=len(file_ids) if progress_bar else None,
+                                         pool=pool, file_ids=batch_ids)
+
+                if merge_at_end:
+                    with self.metrics.stage('index.write'):
+                        runs.append(self.save_run(tfs, len(runs)))
+                else:
+                    with self.metrics.stage('index.merge'):
+                        self.merge_save(tfs)
+                timer.round()
 
-                self.merge_save(tfs)
+            if self.segmented:
+                # a shard may get no file of the folder
+                if runs:
+                    with self.metrics.stage('index.merge'):
+                        self.add_segment(runs)
+                timer.round()
+            elif spimi:
+                with self.metrics.stage('index.merge'):
+                    self.merge_runs(runs)
                 timer.round()
 
             timer.stop(last_round=False)
             batch_times = timer.get_round_durations()
             batch_times.pop(0)
+            if merge_at_end:
+                merge_time = batch_times.pop()
+                print("Merged {} runs in {:02d}m {:02d}s {:03d}ms"
+                      .format(len(runs), *Timer.time_to_tuple(merge_time)))
             print("Indexed {} documents in {} files during {} batches. Total elapsed time \t {:02d}m {:02d}s {:03d}ms"
-                  .format(self.docs_indexed - prev_index, len(files), len(batch_times), *timer.get_duration_tuple()))
-            print("Minimum batch time: \t {:02d}m {:02d}s {:03d}ms".format(*Timer.time_to_tuple(min(batch_times))))
-            print("Maximum batch time: \t {:02d}m {:02d}s {:03d}ms".format(*Timer.time_to_tuple(max(batch_times))))
-            print("Average batch time: \t {:02d}m {:02d}s {:03d}ms"
-                  .format(*Timer.time_to_tuple(statistics.mean(batch_times))))
-            print("Median  batch time: \t {:02d}m {:02d}s {:03d}ms"
-                  .format(*Timer.time_to_tuple(statistics.median(batch_times))))
-            self.save_voc()
+                  .format(self.docs_indexed - prev_index, len(file_ids), len(batch_times),
+                          *timer.get_duration_tuple()))
+            if batch_times:
+                print("Minimum batch time: \t {:02d}m {:02d}s {:03d}ms"
+                      .format(*Timer.time_to_tuple(min(batch_times))))
+                print("Maximum batch time: \t {:02d}m {:02d}s {:03d}ms"
+                      .format(*Timer.time_to_tuple(max(batch_times))))
+                print("Average batch time: \t {:02d}m {:02d}s {:03d}ms"
+                      .format(*Timer.time_to_tuple(statistics.mean(batch_times))))
+                print("Median  batch time: \t {:02d}m {:02d}s {:03d}ms"
+                      .format(*Timer.time_to_tuple(statistics.median(batch_times))))
+            with self.metrics.stage('index.write'):
+                self.save_voc()
+            self.generation += 1
         except Exception as e:
             # print("Error: " + str(e))
             raise e
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
-    def merge_save(self, tf_per_doc):
+    def merge_save(self, batch):
         temp_path = './pl_temp'
         pl_offset = 0
         for w in self.voc:
-            pl = Index.read_pl_for_word(*(self.voc[w]), self.path)
+            pl = self.get_pl(w, cached=False)
 
-            if w in tf_per_doc:
+            if w in batch:
                 for old_document in pl:
                     pl[old_document] = pl[old_document] / self.count[w][1]\
                         if self.count[w][1] != 0 else pl[old_document]
 
-                for new_document, term_frequency in tf_per_doc[w].items():
-                    pl[new_document] = term_frequency
+                documents, tfs = batch.postings(w)
+                pl.update(zip(documents.tolist(), tfs.tolist()))
                 self.count[w] = (
-                    self.count[w][0] + len(tf_per_doc[w]),
-                    self.inverse_document_freq(self.count[w][0] + len(tf_per_doc[w]))
+                    self.count[w][0] + len(documents),
+                    self.inverse_document_freq(self.count[w][0] + len(documents))
                 )
 
-            pl_len = 0
-            for document, term_frequency in pl.items():
-                pl_len += self.write_pl_row(document, term_frequency * self.count[w][1], temp_path)
+            pl_len = self.write_pl(w, list(pl.keys()), [tf * self.count[w][1] for tf in pl.values()], temp_path)
             self.voc[w] = (pl_len, pl_offset)
             pl_offset += pl_len
 
-        # iterate in tf_per_doc for words not in voc
-        for w in tf_per_doc:
+        # iterate in the batch for words not in voc
+        for w in batch:
             if w not in self.voc:
+                documents, tfs = batch.postings(w)
                 #               count of docs the word shows up in, idf
-                self.count[w] = (len(tf_per_doc[w]), self.inverse_document_freq(len(tf_per_doc[w])))
-                pl_len = 0
-                for new_document, term_frequency in tf_per_doc[w].items():
-                    pl_len += self.write_pl_row(new_document, term_frequency * self.count[w][1], temp_path)
+                self.count[w] = (len(documents), self.inverse_document_freq(len(documents)))
+                pl_len = self.write_pl(w, documents.tolist(), (tfs * self.count[w][1]).tolist(), temp_path)
                 self.voc[w] = (pl_len, pl_offset)
                 pl_offset += pl_len
 
         self.finalize_merge_pl(temp_path, self.path)
         return
 
-    def apply_word_filters(self, value):
-        for f in self.word_filters:
-            value = f.prepare_word(value)
+    def save_run(self, batch, run_number):
+        # A run holds the batch sorted by word: word length, word, PL length, then (document, tf) rows
+        run_path = '{}_run{}'.format(self.path, run_number)
+        with open(run_path, 'wb') as run:
+            for w in sorted(batch):
+                documents, tfs = batch.postings(w)
+                rows = numpy.empty(len(documents), dtype=PL_ROW)
+                rows['document'] = documents
+                rows['score'] = tfs
+                encoded = w.encode('utf-8')
+                run.write(struct.pack('!H', len(encoded)))
+                run.write(encoded)
+                run.write(struct.pack('!I', len(rows)))
+                run.write(rows.tobytes())
+        return run_path
 
-        return value
+    @staticmethod
+    def read_run(run_path, run_number):
+        with open(run_path, 'rb') as run:
+            while True:
+                header = run.read(2)
+                if len(header) < 2:
+                    return
+                word = run.read(struct.unpack('!H', header)[0]).decode('utf-8')
+                pl_len = struct.unpack('!I', run.read(4))[0]
+                # The run number keeps the merged PL sorted by document when a word spans several runs
+                yield word, run_number, list(struct.iter_unpack('!If', run.read(pl_len * 8)))
+
+    def read_index_as_run(self, run_number=-1):
+        # Existing postings are stored with their old IDF applied, get back to the TF before merging
+        for w in sorted(self.voc):
+            pl = self.get_pl(w, cached=False)
+            idf = self.count[w][1]
+            yield w, run_number, [(document, score / idf if idf != 0 else score) for document, score in pl.items()]
+
+    def merge_runs(self, run_paths):
+        sources = [Index.read_run(run_path, n) for n, run_path in enumerate(run_paths)]
+        if self.voc:
+            sources.append(self.read_index_as_run())
+        self.merge_sources(sources)
+        for run_path in run_paths:
+            os.remove(run_path)
+
+    def merge_sources(self, sources):
+        # k-way merge of sources of (word, run number, [(document, tf)]) sorted by word into a new posting list
+        temp_path = self.path + '_temp'
+        for stale_path in (temp_path, temp_path + '_impact'):
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
 
-    def process_files(self, files, start_value=0, total=None):
-        files_indexed = start_value
-        # Dictionary of term frequencies per word per doc
+        pl_offset = 0
+        new_voc = {}
+        current_word = None
+        postings = []
+        for word, _, pl in heapq.merge(*sources, key=lambda entry: (entry[0], entry[1])):
+            if word != current_word and current_word is not None:
+                pl_offset += self.write_merged_pl(current_word, postings, pl_offset, new_voc, temp_path)
+                postings = []
+            current_word = word
+            postings.extend(pl)
+        if current_word is not None:
+            self.write_merged_pl(current_word, postings, pl_offset, new_voc, temp_path)
+
+        self.voc = new_voc
+        self.finalize_merge_pl(temp_path, self.path)
 
-        tf_per_doc = {}
-        for filename in files:
-            for doc_id, text in doc_utils.extract_data(filename, files_indexed).items():
-                # Create index vectors
-                vect = numpy.zeros(self.vectors_size)
-                for i in range(1, 4):
-                    rand = int(self.vectors_size * numpy.random.random_sample())
-                    vect[rand] = 1
-                for i in range(1, 4):
-                    rand = int(self.vectors_size * numpy.random.random_sample())
-                    vect[rand] = -1
-                self.index_vectors[doc_id] = vect
-
-                # Remove punctuation from words
-                # The maximum frequency of a word in the doc
-                max_freq = 1
-
-                for line_filter in self.line_filters:
-                    text = line_filter.prepare_line(text)
-                words = text.split(" ")
-                words = [self.apply_word_filters(x) for x in words]
-                words = [x for x in words if not x == ""]
-
-                for w in words:
-                    # Set up dictionary
-                    if w not in tf_per_doc:
-                        tf_per_doc[w] = {}
-                        if w not in self.context_vectors.keys():
-                            self.context_vectors[w] = numpy.zeros(self.vectors_size)
-                        self.context_vectors[w] += vect
-                        self.context_vectors[w] = self.context_vectors[w] / numpy.linalg.norm(self.context_vectors[w])
-                    if doc_id not in tf_per_doc[w]:
-                        tf_per_doc[w][doc_id] = 0
-                    tf_per_doc[w][doc_id] += 1
-                    if tf_per_doc[w][doc_id] > max_freq:
-                        max_freq = tf_per_doc[w][doc_id]
-                # Calculate tf for each entry
-                for w in words:
-                    tf_per_doc[w][doc_id] = Index.term_frequency(tf_per_doc[w][doc_id], max_freq)
-
-                self.docs_indexed += 1
+    def open_segment(self, path):
+        if path not in self.__segment_indexes:
+            # the posting lists read from the segments are cached by this index
+            segment = Index(path, self.line_filters, self.word_filters, verbose=False, score_bits=self.score_bits,
+                            impact=self.impact, pl_cache_size=0)
+            segment.is_segment = True
+            segment.metrics = self.metrics
+            if os.path.exists(segment.dictionary_path):
+                segment.load_dictionary()
+            self.__segment_indexes[path] = segment
+        return self.__segment_indexes[path]
+
+    def get_segments(self):
+        return [self.open_segment(path) for path in self.segments]
+
+    def create_segment(self):
+        path = '{}_seg{}'.format(self.path, self.segments_created)
+        self.segments_created += 1
+        return self.open_segment(path)
+
+    def get_segments_pl(self, word, read_segment_pl):
+        # Later segments hold higher document ids, so the PL of the segments are concatenated in order
+        parts = [read_segment_pl(segment) for segment in self.get_segments() if word in segment.voc]
+        rows = numpy.concatenate(parts) if parts else numpy.empty(0, dtype=PL_ROW)
+        if word in self.count:
+            rows['score'] *= self.count[word][1]
+        return rows
+
+    def add_segment(self, run_paths):
+        segment = self.create_segment()
+        segment.merge_runs(run_paths)
+        segment.save_dictionary()
+        self.segments.append(segment.path)
+        for w in segment.voc:
+            if w in self.count:
+                self.count[w] = (self.count[w][0] + segment.count[w][0],)
+                self.max_tf[w] = max(self.max_tf.get(w, 0), segment.get_max_score(w))
+            else:
+                self.count[w] = (segment.count[w][0],)
+                self.max_tf[w] = segment.get_max_score(w)
+            # the posting lists are in the segments
+            self.voc[w] = (0, 0)
+        self.update_idf()
+        # the IDF of the cached posting lists changed
+        self.pl_cache.clear()
+
+    def update_idf(self, document_freqs=None, docs_indexed=None):
+        # Every IDF changes with the number of docs, it is cheap to update them as the posting lists only keep the TF.
+        # A shard is given the DF of every word and the number of docs of the whole collection instead of its own
+        if document_freqs is not None:
+            for w in document_freqs:
+                if w not in self.count:
+                    # the word is only in other shards: its PL is empty, but the queries see the same vocabulary
+                    self.count[w] = (0,)
+                    self.voc[w] = (0, 0)
+                    self.get_term_id(w)
+            # zero context vectors for the new term ids
+            self.add_context_vectors([], numpy.empty((0, 6), dtype=numpy.int64))
+            self.pl_cache.clear()
+        for w in self.count:
+            idf = self.inverse_document_freq(self.count[w][0] if document_freqs is None else document_freqs[w],
+                                             docs_indexed)
+            # TF are between 0.5 and 1
+            max_score = self.max_tf.get(w, 0) * idf if idf >= 0 else 0.5 * idf
+            self.count[w] = (self.count[w][0], idf, max_score + abs(max_score) * 1e-6)
+
+    def compact(self):
+        # Merges every segment into a single one
+        if not self.segmented or len(self.segments) < 2:
+            return
+        timer = Timer()
+        timer.start()
+        self.load_dictionary_in_memory()
+        segments = self.get_segments()
+        compacted = self.create_segment()
+        with self.metrics.stage('index.merge'):
+            compacted.merge_sources([segment.read_index_as_run(n) for n, segment in enumerate(segments)])
+        compacted.save_dictionary()
+        self.segments = [compacted.path]
+        self.pl_cache.clear()
+        self.generation += 1
+        for segment in segments:
+            del self.__segment_indexes[segment.path]
+            for path in (segment.path, segment.impact_path, segment.dictionary_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.save_voc()
+        timer.stop()
+        print("Compacted {} segments in {:02d}m {:02d}s {:03d}ms".format(len(segments), *timer.get_duration_tuple()))
+
+    def write_merged_pl(self, word, postings, pl_offset, new_voc, path):
+        self.count[word] = (len(postings), self.inverse_document_freq(len(postings)))
+        pl_len = self.write_pl(word, [document for document, _ in postings],
+                               [tf * self.count[word][1] for _, tf in postings], path)
+        new_voc[word] = (pl_len, pl_offset)
+        return pl_len
+
+    def process_files(self, files, start_value=0, total=None, pool=None, file_ids=None):
+        files_indexed = start_value
+        # Postings of the batch by term id
+        batch = BatchPostings()
+        if file_ids is None:
+            file_ids = range(start_value, start_value + len(files))
+        jobs = [(filename, file_id, self.tokenizer, self.positional) for filename, file_id in zip(files, file_ids)]
+        # Files are parsed and tokenized by the workers, imap keeps them in order
+        files_terms = pool.imap(count_terms_in_file, jobs) if pool is not None else map(count_terms_in_file, jobs)
+        for file_terms, parse_time, tokenize_time in files_terms:
+            # time spent by the workers
+            self.metrics.observe('index.parse', parse_time)
+            self.metrics.observe('index.tokenize', tokenize_time)
+            with self.metrics.stage('index.accumulate'):
+                for doc_id, counts, max_freq, location, positions in file_terms:
+                    self.documents.add(doc_id, *location)
+                    if positions is not None:
+                        self.write_positions_entry(doc_id, list(positions.values()))
+                    batch.add_document(doc_id, [self.get_term_id(w) for w in counts], counts.values(), max_freq)
+                    self.docs_indexed += 1
 
             files_indexed += 1
             if total is not None:
@@ -261,11 +910,64 @@ class Index:
                                         prefix='Adding files: ',
                                         suffix='Complete',
                                         bar_length=80)
-        return tf_per_doc
+        with self.metrics.stage('index.accumulate'):
+            batch.group(self.terms)
+        with self.metrics.stage('index.write'):
+            self.write_forward_entries(batch)
+            self.save_forward_to_disk()
+            self.save_positions_to_disk()
+            self.documents.save_to_disk()
+        if len(batch.documents):
+            with self.metrics.stage('index.vectors'):
+                # Create index vectors
+                batch_vectors = numpy.random.randint(self.vectors_size, size=(len(batch.documents), 6))
+                self.index_vectors = numpy.concatenate((self.index_vectors, batch_vectors.astype(numpy.int16)))
+                self.index_vector_docs = numpy.concatenate((self.index_vector_docs,
+                                                            numpy.array(batch.documents, dtype=numpy.uint32)))
+                # the context vector of a word gets the index vector of the first doc of the batch where it was seen
+                self.add_context_vectors(batch.term_ids, batch_vectors[batch.first_positions])
+        self.metrics.count('index.batches')
+        self.metrics.count('index.files', len(files))
+        self.metrics.count('index.documents', len(batch.documents))
+        return batch
+
+    def document_lengths(self):
+        # Number of distinct words of each document of the forward index
+        return voc_tables.document_entries(self.forward_voc)['length'].astype(numpy.int64) // FORWARD_ROW.itemsize
+
+    def stats(self, top=10):
+        return index_stats.compute(self, top)
 
     def print_index_stats(self):
-        print("Words in index")
-        print(len(self.voc))
-        print('====')
-        print(self.docs_indexed)
-        # TODO MOOOORE
+        print(index_stats.format_report(self.stats()))
+
+
+def count_terms_in_file(job):
+    # Runs in the indexing workers: returns (doc_id, occurrences per word, maximum frequency,
+    # (byte offset, byte length, title), positions per word or None) for each document, with the time spent parsing
+    # the file and tokenizing its documents
+    filename, files_indexed, tokenizer, positional = job
+    docs = []
+    start = time.monotonic()
+    tokenize_time = 0
+    try:
+        for offset, length, article in doc_utils.iter_articles(filename):
+            tokenize_start = time.monotonic()
+            words = tokenizer.tokenize(doc_utils.article_text(article))
+            positions = None
+            if positional:
+                positions = {}
+                for position, w in enumerate(words):
+                    positions.setdefault(w, []).append(position)
+                counts = {w: len(word_positions) for w, word_positions in positions.items()}
+            else:
+                counts = dict(Counter(words))
+            # The maximum frequency of a word in the doc
+            max_freq = max(counts.values()) if counts else 1
+            tokenize_time += time.monotonic() - tokenize_start
+            docs.append((doc_utils.article_doc_id(article, files_indexed), counts, max_freq,
+                         (offset, length, doc_utils.article_title(article)), positions))
+    except ParseError:
+        # the documents before the malformed one are indexed
+        pass
+    return docs, time.monotonic() - start - tokenize_time, tokenize_time
@@ -0,0 +1,148 @@
+import os
+import numpy
+
+import pl_compression
+import term_dictionary
+
+PERCENTILES = (50, 90, 99, 100)
+# Bytes of a varint: 1 up to 2^7, 2 up to 2^14...
+VARINT_LIMITS = numpy.array([1 << 7, 1 << 14, 1 << 21, 1 << 28], dtype=numpy.uint64)
+
+
+def vocabulary_rows(index):
+    # Words with the length and offset of their posting list, sorted by offset: the file is read in order
+    if isinstance(index.voc, term_dictionary.DictionaryView):
+        dictionary = index.voc.dictionary
+        words = list(dictionary)
+        lengths = dictionary.rows['length'].astype(numpy.int64)
+        offsets = dictionary.rows['offset'].astype(numpy.int64)
+    else:
+        words = list(index.voc)
+        lengths = numpy.array([index.voc[w][0] for w in words], dtype=numpy.int64)
+        offsets = numpy.array([index.voc[w][1] for w in words], dtype=numpy.int64)
+    order = numpy.argsort(offsets, kind='stable')
+    return [words[i] for i in order.tolist()], lengths[order]
+
+
+def varint_bytes(values):
+    return len(values) + int(numpy.searchsorted(VARINT_LIMITS, values, side='right').sum())
+
+
+def scan_posting_lists(index, totals):
+    # One pass over the posting list file of the index: rows, bytes and size of the document gaps as varints of each
+    # word, added to totals
+    words, lengths = vocabulary_rows(index)
+    for w, pl_len in zip(words, lengths.tolist()):
+        if pl_len == 0:
+            continue
+        documents = index.read_pl_array(w)['document'].astype(numpy.uint64)
+        gaps = numpy.diff(documents, prepend=numpy.uint64(0))
+        rows, pl_bytes, gap_bytes, headers = totals.get(w, (0, 0, 0, 0))
+        totals[w] = (rows + len(documents), pl_bytes + pl_len, gap_bytes + varint_bytes(gaps),
+                     headers + varint_bytes(numpy.array([len(documents)], dtype=numpy.uint64)) + 4)
+
+
+def file_sizes(index):
+    paths = {'posting lists': [index.path], 'impact posting lists': [index.impact_path],
+             'term dictionary': [index.dictionary_path, index.block_max_path, index.block_max_offsets_path],
+             'forward index': [index.forward_path, index.forward_voc_path],
+             'positions': [index.positions_path, index.positions_voc_path],
+             'documents': [index.documents.path, index.documents.titles_path],
+             'vectors': [index.path + suffix for suffix in ('_index_vectors.npy', '_index_vector_docs.npy',
+                                                            '_context_vectors.npy')]}
+    for segment in index.get_segments():
+        paths['posting lists'].append(segment.path)
+        paths['impact posting lists'].append(segment.impact_path)
+        paths['term dictionary'].append(segment.dictionary_path)
+    return {name: sum(os.path.getsize(path) for path in files if os.path.exists(path))
+            for name, files in paths.items()}
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return {}
+    return {'p{}'.format(p): float(v) for p, v in zip(PERCENTILES, numpy.percentile(values, PERCENTILES))}
+
+
+def compute(index, top=10):
+    """
+    Statistics of the vocabulary, posting lists and documents of the index. The posting list files are read once,
+    in the order of the file. The compression ratios compare the bytes of the posting lists with 8 bytes per row
+    (the uncompressed format), and the bytes the compressed format would take are estimated from the gaps between
+    the document ids.
+    """
+    totals = {}
+    for posting_file in (index.get_segments() if index.segmented else [index]):
+        scan_posting_lists(posting_file, totals)
+    words = list(totals)
+    rows = numpy.array([totals[w][0] for w in words], dtype=numpy.int64)
+    pl_bytes = numpy.array([totals[w][1] for w in words], dtype=numpy.int64)
+    gap_bytes = int(sum(t[2] for t in totals.values()))
+    headers = int(sum(t[3] for t in totals.values()))
+    raw_bytes = int(rows.sum()) * 8
+
+    # DF distribution by powers of 2: [1], [2, 3], [4, 7]...
+    df_buckets = {}
+    if len(rows):
+        for bucket, n in enumerate(numpy.bincount(numpy.log2(rows).astype(numpy.int64)).tolist()):
+            if n:
+                df_buckets['{}-{}'.format(1 << bucket, (2 << bucket) - 1)] = n
+
+    doc_lengths = index.document_lengths()
+    # empty without terms or documents, like the percentiles
+    document_frequency = dict(percentiles(rows), mean=float(rows.mean())) if len(rows) else {}
+    words_per_document = dict(percentiles(doc_lengths), mean=float(doc_lengths.mean())) if len(doc_lengths) else {}
+    largest = numpy.argsort(-rows, kind='stable')[:top]
+    estimated = {bits: headers + int(rows.sum()) * pl_compression.SCORE_DTYPES[bits].itemsize + gap_bytes
+                 for bits in pl_compression.SCORE_DTYPES}
+    return {
+        'documents': index.docs_indexed,
+        'terms': len(words),
+        'postings': int(rows.sum()),
+        'document_frequency': document_frequency,
+        'document_frequency_distribution': df_buckets,
+        'terms_in_one_document': int((rows == 1).sum()),
+        'posting_list_bytes': dict(percentiles(pl_bytes), total=int(pl_bytes.sum()),
+                                   per_term=float(pl_bytes.mean()) if len(rows) else 0.0),
+        'largest_posting_lists': [{'word': words[i], 'documents': int(rows[i]), 'bytes': int(pl_bytes[i])}
+                                  for i in largest.tolist()],
+        'distinct_words_per_document': words_per_document,
+        'compression': {
+            'format': 'raw' if index.score_bits is None else '{} bits scores'.format(index.score_bits),
+            'uncompressed_bytes': raw_bytes,
+            'ratio': raw_bytes / int(pl_bytes.sum()) if len(rows) else 1.0,
+            'estimated_bytes': {bits: size for bits, size in estimated.items()},
+            'estimated_ratio': {bits: raw_bytes / size if size else 1.0 for bits, size in estimated.items()},
+        },
+        'files': file_sizes(index),
+    }
+
+
+def format_report(stats):
+    lines = ["Documents: {documents}, terms: {terms}, postings: {postings}".format(**stats)]
+    df = stats['document_frequency']
+    if df:
+        lines.append("Document frequency: mean {:.1f}, median {:.0f}, p90 {:.0f}, p99 {:.0f}, max {:.0f}"
+                     .format(df['mean'], df['p50'], df['p90'], df['p99'], df['p100']))
+        lines.append("Terms in a single document: {}".format(stats['terms_in_one_document']))
+        lines.append("Terms by document frequency:")
+        lines += ["  {:>15} {:>10}".format(bucket, n) for bucket, n in stats['document_frequency_distribution'].items()]
+        pl_bytes = stats['posting_list_bytes']
+        lines.append("Posting list bytes: {} in total, {:.1f} per term, median {:.0f}, p90 {:.0f}, p99 {:.0f}, "
+                     "max {:.0f}".format(pl_bytes['total'], pl_bytes['per_term'], pl_bytes['p50'],
+                                         pl_bytes['p90'], pl_bytes['p99'], pl_bytes['p100']))
+        lines.append("Largest posting lists:")
+        lines += ["  {:<20} {:>10} docs {:>12} bytes".format(pl['word'], pl['documents'], pl['bytes'])
+                  for pl in stats['largest_posting_lists']]
+    doc_lengths = stats['distinct_words_per_document']
+    if doc_lengths:
+        lines.append("Distinct words per document: mean {:.1f}, median {:.0f}, p99 {:.0f}, max {:.0f}"
+                     .format(doc_lengths['mean'], doc_lengths['p50'], doc_lengths['p99'], doc_lengths['p100']))
+    compression = stats['compression']
+    lines.append("Compression ({}): {:.2f}x, estimated {}".format(
+        compression['format'], compression['ratio'],
+        ", ".join("{:.2f}x ({} bytes) with {} bits scores".format(compression['estimated_ratio'][bits], size, bits)
+                  for bits, size in compression['estimated_bytes'].items())))
+    lines.append("Files:")
+    lines += ["  {:<22} {:>12} bytes".format(name, size) for name, size in stats['files'].items()]
+    return "\n".join(lines)
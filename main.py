@@ -1,19 +1,23 @@
 import sys
 import re
 import argparse
+import atexit
+import json
 
 from index import Index
 from search import Searcher
 import text_preprocessing
 from doc_utils import Reader
+from server import QueryServer
+from shards import ShardedIndex, ShardedSearcher
 
 
-def print_results(results, reader=None):
+def print_results(results, reader=None, offset=0):
     for i in range(len(results)):
         result = results[i]
         if reader is not None:
             print("{:03}. id {:09}\t{}\t--- {}"
-                  .format(i + 1, result['document'],
+                  .format(offset + i + 1, result['document'],
                           reader.get_doc_title(result['document']),
                           result['score']))
         else:
@@ -26,6 +30,11 @@ def read_ux(default_doc, reader):
         doc_id = default_doc
     print(reader.read_doc(int(doc_id)))
 
+def save_metrics(metrics, path):
+    with open(path, 'w') as f:
+        f.write(metrics.to_prometheus() if path.endswith('.prom') else metrics.to_json())
+
+
 def main():
     parser = argparse.ArgumentParser(description='Text indexing',
                                      epilog='Written for the INSA Lyon text-indexing Project by Anh Pham, Mathilde du '
@@ -40,6 +49,39 @@ def main():
     parser.add_argument('-s', '--stopwords', help='Filter stopwords from the index', action='store_true')
     parser.add_argument('--stem', help='Use stemming', action='store_true')
     parser.add_argument('--progress-bar', help='Show a progress bar while indexing', action='store_true')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of processes parsing the documents while indexing')
+    parser.add_argument('--compress', type=int, choices=[8, 16], default=None,
+                        help='Compress the posting list, scores are quantized on the given number of bits')
+    parser.add_argument('--impact', help='Also save the posting lists sorted by score, for the top k searches',
+                        action='store_true')
+    parser.add_argument('--spimi', help='Write each batch as a sorted run and merge them once at the end',
+                        action='store_true')
+    parser.add_argument('--segments', help='Save each indexed folder as an immutable segment of the index',
+                        action='store_true')
+    parser.add_argument('--positions', help='Also save the positions of the words, for the "phrase" and "words"~N '
+                        'queries', action='store_true')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='Split the index into N shards, each one searched by its own process')
+    parser.add_argument('--compact', help='Merge the segments of the loaded index into a single one and exit',
+                        action='store_true')
+    parser.add_argument('--pl-cache', type=int, default=64,
+                        help='Size in MB of the cache of the most recently read posting lists, 0 to disable it')
+    parser.add_argument('--query-cache', type=int, default=256,
+                        help='Number of query results kept in the cache, 0 to disable it')
+    parser.add_argument('--query-ttl', type=float, default=None,
+                        help='Seconds before a cached query result expires (never by default)')
+    parser.add_argument('--page-size', type=int, default=10,
+                        help='Number of search results shown at once, 0 to show them all')
+    parser.add_argument('--serve', metavar='[HOST:]PORT', default=None,
+                        help='Serve the queries over TCP instead of the menu, one JSON request per line')
+    parser.add_argument('--metrics', metavar='PATH', default=None,
+                        help='Save the timings of the stages of the indexing and queries on exit, in the Prometheus '
+                             'text format if PATH ends with .prom, as JSON otherwise')
+    parser.add_argument('--stats', nargs='?', const='text', choices=['text', 'json'], default=None,
+                        help='Print the statistics of the vocabulary and posting lists of the loaded index and exit')
+    parser.add_argument('--server-threads', type=int, default=4,
+                        help='Number of threads running the queries of the server')
     args = parser.parse_args()
 
     if len(sys.argv) < 2:
@@ -57,14 +99,35 @@ def main():
     line_filters = text_preprocessing.get_instances_of_all_line_preparators(stopwords=args.stopwords)
     word_filters = text_preprocessing.get_instances_of_all_word_preparators(stemming=args.stem)
     # Get a instance of our index and search
-    index = Index(path, line_filters, word_filters, args.load)
-    searcher = Searcher(index)
+    if args.shards:
+        index = ShardedIndex(path, line_filters, word_filters, args.shards, args.load, score_bits=args.compress,
+                             impact=args.impact, pl_cache_size=args.pl_cache * 2 ** 20, positional=args.positions)
+        searcher = ShardedSearcher(index, args.query_cache, args.query_ttl)
+    else:
+        index = Index(path, line_filters, word_filters, args.load, score_bits=args.compress, impact=args.impact,
+                      segmented=args.segments, pl_cache_size=args.pl_cache * 2 ** 20, positional=args.positions)
+        searcher = Searcher(index, args.query_cache, args.query_ttl)
     reader = Reader(index)
+    if args.metrics:
+        atexit.register(save_metrics, index.metrics, args.metrics)
     # Prepare the RegEx to find numbers in our user input
     int_find = re.compile('\d+')
 
+    if args.compact:
+        index.compact()
+        return
+    if args.stats:
+        if args.stats == 'json':
+            print(json.dumps(index.stats(), indent=2))
+        else:
+            index.print_index_stats()
+        return
     if args.eval:
-        index.index_folder(args.eval, batch_size, args.progress_bar)
+        index.index_folder(args.eval, batch_size, args.progress_bar, args.spimi, args.workers)
+        return
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        QueryServer(searcher, reader, args.server_threads).run(host or 'localhost', int(port))
         return
     print("\nWelcome to the research engine")
     print("==============================")
@@ -78,7 +141,9 @@ def main():
         print("5) Read a document")
         print("6) Search with Fagin's algorithm")
         print("7) Look for semantically similar words")
-        print("8) Exit")
+        print("8) Search with the Threshold Algorithm")
+        print("9) Search the top k documents with Block-Max WAND")
+        print("10) Exit")
         print("\n Please enter the number of a menu item")
 
         user_choice = input('> ')
@@ -93,6 +158,10 @@ def main():
         # We know it's only digits, so no exception handling here
         menu_item = int(menu_item.string)
         default_doc = -1
+        if args.shards and menu_item in (4, 7):
+            # the vectors of the documents and words are split between the shards
+            print("Not available on a sharded index")
+            continue
 
         if menu_item == 1:
             # Get a folder
@@ -101,18 +170,32 @@ def main():
             folder = input('({}) > '.format(default)).strip()
             if folder == "":
                 folder = default
-            index.index_folder(folder, batch_size, args.progress_bar)
+            index.index_folder(folder, batch_size, args.progress_bar, args.spimi, args.workers)
         elif menu_item == 2:
+            # only the documents up to the shown page are selected, the next page searches the top k again
+            page_size = args.page_size or None
+            last_query = None
+            offset = 0
             while True:
-                search_query = input('\nType :read to display a document or :quit to return to menu'
-                                     '\nPlease enter your search query: ')
+                search_query = input('\nType :read to display a document, :more for the next results or :quit to '
+                                     'return to menu\nPlease enter your search query: ')
                 if search_query == ":quit":
                     break
                 elif search_query == ":read":
                     read_ux(default_doc, reader)
+                elif search_query == ":more" and (last_query is None or page_size is None):
+                    print("No more results")
                 else:
-                    results = searcher.search(search_query)
-                    print_results(results, reader if args.title else None)
+                    if search_query == ":more":
+                        offset += page_size
+                    else:
+                        last_query = search_query
+                        offset = 0
+                    results = searcher.search(last_query, offset == 0,
+                                              offset + page_size if page_size is not None else None)[offset:]
+                    if offset > 0 and not results:
+                        print("No more results")
+                    print_results(results, reader if args.title else None, offset)
                     if len(results) >= 1:
                         default_doc = results[0]['document']
 
@@ -153,6 +236,22 @@ def main():
             searcher.similar_word(search_query, int(k))
 
         elif menu_item == 8:
+            k = input('Please enter k: ')
+            search_query = input('Please enter your search query: ')
+            results = searcher.search_threshold(search_query, int(k))
+            print_results(results, reader if args.title else None)
+            if len(results) >= 1:
+                default_doc = results[0]['document']
+
+        elif menu_item == 9:
+            k = input('Please enter k: ')
+            search_query = input('Please enter your search query: ')
+            results = searcher.search_wand(search_query, int(k))
+            print_results(results, reader if args.title else None)
+            if len(results) >= 1:
+                default_doc = results[0]['document']
+
+        elif menu_item == 10:
             exit(0)
 
         else:
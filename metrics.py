@@ -0,0 +1,118 @@
+import contextlib
+import json
+import math
+import threading
+
+from timer import Timer
+
+# Upper bounds in seconds of the buckets of the histograms
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile, the maximum for the last bucket
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """
+    Counters and histograms of durations, by name. Stages are timed with a Timer and only count the time spent
+    outside their nested stages, so the stages of a query add up to its latency: a stage holding the reading of the
+    posting lists does not count it twice. Counters and histograms are updated under a lock, they can be shared by
+    the threads of the query server.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        # stages running in the current thread: [name, time of their nested stages]
+        self.local = threading.local()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self.local.__dict__.setdefault('stack', [])
+        if any(running[0] == name for running in stack):
+            # a stage nested in itself, like the posting lists of the segments read for the main index, counts once
+            yield
+            return
+        timer = Timer()
+        stack.append([name, 0.0])
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.stop()
+            nested = stack.pop()[1]
+            if stack:
+                stack[-1][1] += timer.float_duration
+            self.observe(name, timer.float_duration - nested)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: {'count': h.count, 'sum': h.sum, 'mean': h.sum / h.count if h.count else 0.0,
+                                      'max': h.max, 'p50': h.quantile(0.5), 'p95': h.quantile(0.95),
+                                      'p99': h.quantile(0.99),
+                                      'buckets': {str(bound): n for bound, n in zip(BUCKETS, h.buckets)}}
+                               for name, h in self.histograms.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix='text_indexing'):
+        # Text exposition format: one counter per counter, one histogram of seconds per stage
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = '{}_{}_total'.format(prefix, name.replace('.', '_'))
+                lines += ['# TYPE {} counter'.format(metric), '{} {}'.format(metric, value)]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = '{}_{}_seconds'.format(prefix, name.replace('.', '_'))
+                lines.append('# TYPE {} histogram'.format(metric))
+                cumulated = 0
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    cumulated += count
+                    le = '+Inf' if bound == math.inf else bound
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(metric, le, cumulated))
+                lines += ['{}_sum {}'.format(metric, histogram.sum), '{}_count {}'.format(metric, histogram.count)]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+
+class PostingListCache:
+    """
+    Least recently used posting lists, bounded by the total size of their arrays in bytes.
+    A capacity of 0 disables the cache. It can be shared by the threads of the query server.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, word):
+        # The cached array, None if the word is not in the cache
+        with self.lock:
+            rows = self.entries.get(word)
+            if rows is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(word)
+            self.hits += 1
+            return rows
+
+    def put(self, word, rows):
+        # Missing words are not kept, their empty arrays would never be evicted
+        if rows.nbytes == 0 or rows.nbytes > self.capacity:
+            return
+        # Cached arrays are shared by every caller
+        rows.flags.writeable = False
+        with self.lock:
+            if word in self.entries:
+                self.size -= self.entries.pop(word).nbytes
+            self.entries[word] = rows
+            self.size += rows.nbytes
+            while self.size > self.capacity:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        # The posting lists changed on the disk, the counters are kept
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.size, 'capacity': self.capacity, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
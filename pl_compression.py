@@ -0,0 +1,88 @@
+import struct
+import numpy
+
+# Version 1 is the uncompressed '!If' rows format, version 2 is the compressed format of this module
+RAW_FORMAT_VERSION = 1
+COMPRESSED_FORMAT_VERSION = 2
+SCORE_DTYPES = {8: numpy.dtype('u1'), 16: numpy.dtype('>u2')}
+SCORE_FORMATS = {8: 'B', 16: 'H'}
+VECTORIZED_DECODE_MIN_BYTES = 64
+
+
+def encode_varints(values):
+    # Variable-byte encoding: 7 bits per byte, the high bit is set on every byte but the last one of a value
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(buffer):
+    data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    if len(data) < VECTORIZED_DECODE_MIN_BYTES:
+        # NumPy calls cost more than a plain loop on the many short posting lists
+        values = []
+        offset = 0
+        while offset < len(buffer):
+            value, offset = read_varint(buffer, offset)
+            values.append(value)
+        return numpy.array(values, dtype=numpy.uint64)
+    is_last = data < 0x80
+    starts = numpy.concatenate(([0], numpy.flatnonzero(is_last)[:-1] + 1))
+    value_index = numpy.concatenate(([0], numpy.cumsum(is_last)[:-1]))
+    shifts = (numpy.arange(len(data)) - starts[value_index]) * 7
+    parts = (data & 0x7f).astype(numpy.uint64) << shifts.astype(numpy.uint64)
+    return numpy.add.reduceat(parts, starts)
+
+
+def read_varint(buffer, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def quantize(scores, score_bits):
+    # Scores of a PL all have the sign of the IDF, so they are quantized between 0 and the score of biggest magnitude
+    levels = (1 << score_bits) - 1
+    scale = max(scores, key=abs) if len(scores) else 0.0
+    if scale == 0:
+        return scale, [0] * len(scores)
+    factor = levels / scale
+    return scale, [round(score * factor) for score in scores]
+
+
+def quantized_scores(scores, score_bits):
+    # The scores as decode_pl reads them back, with the scale rounded to a float like in the block
+    scale, quantized = quantize(scores, score_bits)
+    scale = struct.unpack('!f', struct.pack('!f', scale))[0]
+    return numpy.asarray(quantized, dtype=SCORE_DTYPES[score_bits]) * (scale / ((1 << score_bits) - 1))
+
+
+def encode_pl(documents, scores, score_bits):
+    # Block layout: varint number of rows, '!f' scale, quantized scores, varint gaps between sorted document ids
+    scale, quantized = quantize(scores, score_bits)
+    gaps = [documents[0]] + [documents[i] - documents[i - 1] for i in range(1, len(documents))]
+    return encode_varints([len(documents)]) + struct.pack('!f', scale) \
+        + struct.pack('!{}{}'.format(len(quantized), SCORE_FORMATS[score_bits]), *quantized) + encode_varints(gaps)
+
+
+def decode_pl(buffer, score_bits):
+    # Returns the documents and scores of a block written by encode_pl
+    count, offset = read_varint(buffer, 0)
+    scale = struct.unpack_from('!f', buffer, offset)[0]
+    offset += 4
+    score_dtype = SCORE_DTYPES[score_bits]
+    quantized = numpy.frombuffer(buffer, dtype=score_dtype, count=count, offset=offset)
+    offset += count * score_dtype.itemsize
+    documents = numpy.cumsum(decode_varints(buffer[offset:]))
+    scores = quantized * (scale / ((1 << score_bits) - 1))
+    return documents, scores
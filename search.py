@@ -1,227 +1,676 @@
 from timer import Timer
-from collections import OrderedDict
+from index import Index, BLOCK_SIZE
+from result_cache import ResultCache
+import functools
+import heapq
+import bisect
+import inspect
+import multiprocessing
+import re
 
 import numpy
 
 
+# The documents are looked for one by one in a PL this many times longer than their number, instead of converting the
+# whole PL for a vectorized search
+GALLOP_RATIO = 1024
+# Block-Max WAND bounds each row of the posting lists up to this length by its own score instead of its block
+SHORT_LIST_ROWS = 1024
+# Block-Max WAND scores the queries with fewer rows in their posting lists at once
+WAND_MIN_ROWS = 32768
+
+
+# "exact phrase" or "words within"~N positions of each other
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+# Documents of a phrase and the sum of the scores of its words, intersected like a posting list
+PHRASE_ROW = numpy.dtype([('document', numpy.int64), ('score', numpy.float64)])
+
+
+def operand_words(operand):
+    # Words of a word or of a "word1"word2"~N phrase token
+    if operand.startswith('"'):
+        return operand.rsplit('"', 1)[0][1:].split('"')
+    return [operand]
+
+
+def phrase_matches(positions_lists, slop=None):
+    # True if the words with these positions in a doc follow each other, or all fit in slop + 1 positions
+    if slop is None:
+        starts = set(positions_lists[0])
+        for i in range(1, len(positions_lists)):
+            starts &= {position - i for position in positions_lists[i]}
+        return bool(starts)
+    # sliding window: last position of each word up to the current one
+    last = {}
+    for position, i in sorted((p, i) for i, positions in enumerate(positions_lists) for p in positions):
+        last[i] = position
+        if len(last) == len(positions_lists) and position - min(last.values()) <= slop:
+            return True
+    return False
+
+
+def top_k_order(scores, k=None, ties=None):
+    # Positions of the k largest scores by decreasing score, equal scores in the order of ties (their position by
+    # default). Only the scores at least equal to the k-th one are sorted
+    if ties is None:
+        ties = numpy.arange(len(scores))
+    candidates = numpy.arange(len(scores))
+    if k is not None and k < len(scores):
+        if k <= 0:
+            return candidates[:0]
+        kth_score = -numpy.partition(-scores, k - 1)[k - 1]
+        candidates = numpy.flatnonzero(scores >= kth_score)
+    return candidates[numpy.lexsort((ties[candidates], -scores[candidates]))][:k]
+
+
+def find_positions(pl_documents, documents):
+    # Which of the sorted documents are in the sorted documents of a PL, and their positions in the PL
+    n = len(pl_documents)
+    if n == 0:
+        return numpy.zeros(len(documents), dtype=bool), numpy.empty(0, dtype=numpy.int64)
+    if len(documents) * GALLOP_RATIO < n:
+        # galloping from the last position found: only about log(gap) rows of the PL are read for each document
+        positions = []
+        low = 0
+        for document in documents.tolist():
+            high = low
+            step = 1
+            while high < n and pl_documents[high] < document:
+                low = high + 1
+                high = low + step
+                step *= 2
+            low = bisect.bisect_left(pl_documents, document, low, min(high, n))
+            positions.append(low)
+        positions = numpy.array(positions, dtype=numpy.int64)
+    else:
+        positions = numpy.searchsorted(pl_documents, documents)
+    positions = numpy.minimum(positions, n - 1)
+    found = pl_documents[positions] == documents
+    return found, positions[found]
+
+
+class BlockMaxList:
+    # Posting list of a query word with the range of documents and the maximum score of each of its blocks. Only the
+    # rows of the intervals of documents that can make the top k are converted
+    def __init__(self, index, word):
+        self.rows = index.get_pl_array(word)
+        self.documents = self.rows['document'].astype(numpy.int64)
+        if len(self.documents) <= SHORT_LIST_ROWS:
+            # every row is a block, bounded by its own score
+            self.first_docs = self.last_docs = self.documents
+            self.block_max = self.rows['score'].astype(numpy.float64)
+            return
+        last_rows = numpy.minimum(numpy.arange(BLOCK_SIZE, len(self.documents) + BLOCK_SIZE, BLOCK_SIZE),
+                                  len(self.documents)) - 1
+        self.first_docs = self.documents[::BLOCK_SIZE]
+        self.last_docs = self.documents[last_rows]
+        self.block_max = index.get_block_max(word)
+
+    def bounds(self, starts):
+        # Maximum score of the word in the docs of the intervals beginning at starts, -inf if it is in none of them. An
+        # interval never spans two blocks, as it is cut at the bounds of every block
+        blocks = numpy.maximum(numpy.searchsorted(self.first_docs, starts, side='right') - 1, 0)
+        covered = (starts >= self.first_docs[blocks]) & (starts <= self.last_docs[blocks])
+        return numpy.where(covered, self.block_max[blocks], -numpy.inf)
+
+    def find_rows(self, first_docs, end_docs):
+        # Positions of the first row and after the last row of the word in each range of documents
+        return numpy.searchsorted(self.documents, first_docs), numpy.searchsorted(self.documents, end_docs)
+
+    def read(self, first_rows, end_rows):
+        # Documents and scores of the rows in the ranges of positions
+        lengths = end_rows - first_rows
+        positions = numpy.repeat(first_rows - numpy.cumsum(lengths) + lengths, lengths) + numpy.arange(lengths.sum())
+        return self.documents[positions], self.rows['score'][positions].astype(numpy.float64)
+
+
+def cached_results(mode):
+    # Decorator of the search methods: the results of a normalized query are reused until the index changes
+    def decorator(search_method):
+        signature = inspect.signature(search_method)
+
+        @functools.wraps(search_method)
+        def wrapper(self, word_list, *args, **kwargs):
+            timer = Timer()
+            timer.start()
+            arguments = signature.bind(self, word_list, *args, **kwargs)
+            arguments.apply_defaults()
+            # the search methods split the query on whitespace
+            key = (mode, " ".join(self.prepare_query(word_list).split()), arguments.arguments.get('k'))
+            results = self.result_cache.get(key, self.index.generation)
+            if results is ResultCache.MISS:
+                results = search_method(self, word_list, *args, **kwargs)
+                self.result_cache.put(key, results, self.index.generation)
+            else:
+                timer.stop()
+                # the latency percentiles hold every query answered, computed or not
+                self.index.metrics.count('query.cache_hits.' + mode)
+                self.index.metrics.observe('query.latency.' + mode, timer.float_duration)
+                if arguments.arguments.get('verbose'):
+                    time_tuple = timer.get_duration_tuple()
+                    print("Query returned from the cache in {}s {}ms".format(time_tuple[1], time_tuple[2]))
+            # the cached list is shared, callers get their own copy
+            return list(results) if results is not None else None
+        return wrapper
+    return decorator
+
+
+def measured(mode):
+    # Decorator of the search methods: counts the queries computed and their latency. The time they spend outside the
+    # nested stages (normalizing the query, reading the posting lists, sorting) is the scoring
+    def decorator(search_method):
+        @functools.wraps(search_method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.index.metrics
+            timer = Timer()
+            timer.start()
+            with metrics.stage('query.score'):
+                results = search_method(self, *args, **kwargs)
+            timer.stop()
+            metrics.count('query.' + mode)
+            metrics.observe('query.latency.' + mode, timer.float_duration)
+            return results
+        return wrapper
+    return decorator
+
+
 class Searcher:
-    def __init__(self, index):
+    def __init__(self, index, cache_size=256, cache_ttl=None):
         self.index = index
+        self.result_cache = ResultCache(cache_size, cache_ttl)
+        # query -> normalized query
+        self.prepared_queries = {}
 
     def prepare_query(self, query):
-        for line_filter in self.index.line_filters:
-            query = line_filter.prepare_line(query)
+        prepared = self.prepared_queries.get(query)
+        if prepared is None:
+            if len(self.prepared_queries) >= 10000:
+                self.prepared_queries.clear()
+            with self.index.metrics.stage('query.normalize'):
+                prepared = self.normalize_query(query)
+            self.prepared_queries[query] = prepared
+        return prepared
 
-        separated_parts = query.split("&")
-        for i in range(len(separated_parts)):
-            separated_parts[i] = separated_parts[i].split(" ")
-            for j in range(len(separated_parts[i])):
-                for line_filter in self.index.word_filters:
-                    separated_parts[i][j] = line_filter.prepare_word(separated_parts[i][j])
-            separated_parts[i] = " ".join(separated_parts[i])
-
-        return "&".join(separated_parts)
+    def normalize_query(self, query):
+        tokenizer = self.index.tokenizer
+        # phrases are taken out before the line filters delete the quotes, their words become one "word1"word2"~N
+        # token, an operand of the conjunctive part around it like a word
+        tokens = []
+        pieces = PHRASE_PATTERN.split(query)
+        for i in range(0, len(pieces), 3):
+            # the words between the & go through the same tokenizer as the documents
+            for fragment in re.split('(&)', pieces[i]):
+                tokens.extend([fragment] if fragment == '&' else tokenizer.tokenize(fragment))
+            if i + 1 < len(pieces):
+                words = tokenizer.tokenize(pieces[i + 1])
+                if len(words) > 1:
+                    tokens.append('"' + '"'.join(words) + '"' + ('~' + pieces[i + 2] if pieces[i + 2] else ''))
+                else:
+                    tokens.extend(words)
+        # a & joins the operands on both sides, whatever the spaces around it
+        parts = []
+        join = False
+        for token in tokens:
+            if token == '&':
+                join = bool(parts)
+            elif join:
+                parts[-1].append(token)
+                join = False
+            else:
+                parts.append([token])
+        return " ".join("&".join(part) for part in parts)
 
-    def search(self, word_list, verbose=True):
+    @cached_results('search')
+    @measured('search')
+    def search(self, word_list, verbose=True, k=None):
         timer = Timer()
         timer.start()
+        output = self.score_query(self.prepare_query(word_list).split(), self.index.get_pl_array, k=k)
+        timer.stop()
+        time_tuple = timer.get_duration_tuple()
+        if verbose:
+            print("Query returned in {}s {}ms".format(time_tuple[1], time_tuple[2]))
+        return output
+
+    def score_query(self, word_list, read_pl, report=True, k=None):
+        # The k documents (all by default) of the prepared query words with the best scores, sorted by decreasing score,
+        # read_pl gives the posting list of a word
+        if not any(a_word.find('&') > -1 or a_word.startswith('"') for a_word in word_list):
+            return self.score_disjunctive_query(word_list, read_pl, report, k)
         pl = {}
-        word_list = self.prepare_query(word_list).split()
+
+        def read_operand(operand):
+            # a phrase of a conjunctive part is intersected with the other operands like a posting list
+            if not operand.startswith('"'):
+                return read_pl(operand)
+            phrase_docs, phrase_scores = self.match_phrase(operand, read_pl, report)
+            rows = numpy.empty(len(phrase_docs), dtype=PHRASE_ROW)
+            rows['document'], rows['score'] = phrase_docs, phrase_scores
+            return rows
         for a_word in word_list:
             if a_word.find('&') > -1:
                 conjunctive_part = a_word.split('&')
-                # initialise the pl with the first word
-                if conjunctive_part[0] in self.index.voc:
-                    conj_pl = self.index.read_pl_for_word(*(self.index.voc[conjunctive_part[0]]), self.index.path)
-                else:
-                    print(conjunctive_part[0] + " : Word not found")
+                missing = [[w for w in operand_words(operand) if w not in self.index.voc]
+                           for operand in conjunctive_part]
+                if missing[0]:
+                    if report:
+                        print(missing[0][0] + " : Word not found")
                     break
-                for i in range(1, len(conjunctive_part)):
-                    if conjunctive_part[i] in self.index.voc:
-                        # make the intersection of the documents found for all words of the conjunctive query
-                        found_pl = self.index.read_pl_for_word(*(self.index.voc[conjunctive_part[i]]), self.index.path)
-                        intersect = {}
-                        keys_a = set(conj_pl.keys())
-                        keys_b = set(found_pl.keys())
-                        intersect_keys = keys_a & keys_b
-                        for item in intersect_keys:
-                            intersect.update({item: found_pl[item] + conj_pl[item]})
-                        conj_pl = intersect
-                    else:
-                        print(conjunctive_part[i]+" : Word not found")
-                        conj_pl.clear()
-                        break
-                pl.update(conj_pl)
+                if any(missing):
+                    if report:
+                        print(next(words for words in missing if words)[0] + " : Word not found")
+                    continue
+                conj_docs, conj_scores = self.intersect(conjunctive_part, read_operand)
+                pl.update(zip(conj_docs.tolist(), conj_scores.tolist()))
+            elif a_word.startswith('"'):
+                phrase_docs, phrase_scores = self.match_phrase(a_word, read_pl, report)
+                for document, score in zip(phrase_docs, phrase_scores):
+                    if document not in pl:
+                        pl[document] = 0
+                    pl[document] += score
             elif a_word in self.index.voc:
-                found_pl = self.index.read_pl_for_word(*(self.index.voc[a_word]), self.index.path)
-                for document, score in found_pl.items():
+                found_pl = read_pl(a_word)
+                for document, score in zip(found_pl['document'].tolist(), found_pl['score'].tolist()):
                     if document not in pl:
                         pl[document] = 0
                     pl[document] += score
-            else:
+            elif report:
                 print(a_word+" : Word not found")
-        if not bool(pl):
+        if not bool(pl) and report:
             print("No document found")
-        pl = sorted(pl.items(), key=lambda kv: kv[1], reverse=True)
+        with self.index.metrics.stage('query.sort'):
+            documents = numpy.fromiter(pl.keys(), dtype=numpy.int64, count=len(pl))
+            scores = numpy.fromiter(pl.values(), dtype=numpy.float64, count=len(pl))
+            # ties keep the order in which the docs were found
+            order = top_k_order(scores, k)
+            return [{'document': document, 'score': score}
+                    for document, score in zip(documents[order].tolist(), scores[order].tolist())]
+
+    def match_phrase(self, phrase, read_pl, report=True):
+        # Documents holding the words of a "word1"word2"~N token and the sum of their scores. The docs of the
+        # conjunction of the words are filtered with the positions file, only read for them
+        body, slop = phrase.rsplit('"', 1)
+        words = body[1:].split('"')
+        slop = int(slop[1:]) if slop else None
+        missing = [w for w in words if w not in self.index.voc]
+        if missing:
+            if report:
+                print(missing[0] + " : Word not found")
+            return [], []
+        documents, scores = self.intersect(words, read_pl)
+        if not self.index.positional:
+            if report:
+                print("The index has no positions, the words of the phrase are searched in any place of the documents")
+            return documents.tolist(), scores.tolist()
+        term_ids = [self.index.term_ids[w] for w in words]
+        matches = []
+        for document in documents.tolist():
+            positions = self.index.get_positions(document, term_ids)
+            matches.append(positions is not None and phrase_matches([positions[t] for t in term_ids], slop))
+        matches = numpy.array(matches, dtype=bool)
+        return documents[matches].tolist(), scores[matches].tolist()
+
+    def intersect(self, words, read_pl):
+        # Documents in the PL of every word and the sum of their scores, looked for from the rarest word to the most
+        # common one, so the cost follows the length of the shortest PL
+        pls = [read_pl(w) for w in words]
+        order = sorted(range(len(words)), key=lambda i: len(pls[i]))
+        documents = pls[order[0]]['document']
+        positions = {order[0]: numpy.arange(len(documents))}
+        for i in order[1:]:
+            found, found_positions = find_positions(pls[i]['document'], documents)
+            documents = documents[found]
+            for j in positions:
+                positions[j] = positions[j][found]
+            positions[i] = found_positions
+        # the scores are added in the order of the words of the query
+        scores = pls[0]['score'][positions[0]].astype(numpy.float64)
+        for i in range(1, len(words)):
+            scores = scores + pls[i]['score'][positions[i]]
+        return documents, scores
+
+    def score_disjunctive_query(self, word_list, read_pl, report=True, k=None):
+        # Same scores and order as adding the scores of the PL one after the other in a dict
+        pls = []
+        for a_word in word_list:
+            if a_word in self.index.voc:
+                pls.append(read_pl(a_word))
+            elif report:
+                print(a_word + " : Word not found")
+        documents = numpy.concatenate([found_pl['document'] for found_pl in pls]) if pls else numpy.empty(0)
+        if len(documents) == 0:
+            if report:
+                print("No document found")
+            return []
+        scores = numpy.concatenate([found_pl['score'] for found_pl in pls]).astype(numpy.float64)
+        documents, first_seen, doc_of_row = numpy.unique(documents, return_index=True, return_inverse=True)
+        # the scores of a doc are added in the order of the query words
+        totals = numpy.bincount(doc_of_row, weights=scores)
+        with self.index.metrics.stage('query.sort'):
+            # ties keep the order in which the docs were found
+            order = top_k_order(totals, k, first_seen)
+            return [{'document': document, 'score': score}
+                    for document, score in zip(documents[order].tolist(), totals[order].tolist())]
+
+    @measured('many')
+    def search_many(self, queries, k=None, workers=1):
+        """
+        Results of search for every query, cut to k documents. The posting list of each word of the queries is read
+        once, in the order of the posting list file. With several workers, the queries are split between processes
+        loading the saved index.
+        """
+        if workers > 1:
+            chunk_size = -(-len(queries) // workers)
+            jobs = [(self.index.path, self.index.line_filters, self.index.word_filters,
+                     queries[i:i + chunk_size], k) for i in range(0, len(queries), chunk_size)]
+            with multiprocessing.Pool(workers) as pool:
+                return [results for chunk in pool.map(search_many_in_process, jobs) for results in chunk]
+        prepared = [self.prepare_query(query).split() for query in queries]
+        words = {w for word_list in prepared for a_word in word_list for w in re.split('[&"]', a_word)
+                 if w in self.index.voc}
+        pls = {w: self.index.get_pl_array(w) for w in sorted(words, key=lambda w: self.index.voc[w][1])}
+        return [self.score_query(word_list, pls.__getitem__, report=False, k=k) for word_list in prepared]
+
+    def get_top_k_words(self, word_list):
+        # Every word of a top k query has to be in the documents, None if a word of a conjunctive part is missing
+        words = []
+        for a_word in self.prepare_query(word_list).split():
+            # the words of a phrase are looked for in any place of the documents
+            a_word = "&".join(w for operand in a_word.split('&') for w in operand_words(operand))
+            if a_word.find('&') > -1:
+                for conjunctive_word in a_word.split('&'):
+                    if conjunctive_word in self.index.voc:
+                        words.append(conjunctive_word)
+                    else:
+                        print(conjunctive_word + " : Word not found")
+                        print("No documents found")
+                        return None
+            # disjunctive query
+            elif a_word in self.index.voc:
+                words.append(a_word)
+            else:
+                print(a_word + " : Word not found")
+        return words
+
+    @cached_results('fagins')
+    @measured('fagins')
+    def search_fagins(self, word_list, k, verbose=True):
+        timer = Timer()
+        timer.start()
+        words = self.get_top_k_words(word_list)
+        if words is None:
+            return
+        min_length = min([self.index.get_pl_length(w) for w in words]) if words else 0
+        # In M: doc_id -> scores found in each PL, in C: doc_id -> score of the docs seen in every PL
+        m = {}
+        c = {}
+        line = 0
+        block = max(k, 8)
+
+        # stops when C has k elements or we finished going through all the lines of pl
+        while line < min_length and len(c) < k:
+            # sorted access on the next rows of each pl, read from the score-sorted copy of the PL
+            for i, word in enumerate(words):
+                rows = self.index.get_impact_pl(word, line, min(line + block, min_length))
+                for doc_id, score in zip(rows['document'].tolist(), rows['score'].tolist()):
+                    m.setdefault(doc_id, {})[i] = score
+                    if len(m[doc_id]) == len(words):
+                        c[doc_id] = sum(m.pop(doc_id).values()) / len(words)
+            line += block
+            block *= 2
+
+        # random access for the docs that were not seen in every PL
+        candidates = list(m.keys())
+        totals = numpy.zeros(len(candidates))
+        for i, word in enumerate(words):
+            seen = numpy.array([i in m[doc] for doc in candidates], dtype=bool)
+            scores = numpy.array([m[doc].get(i, 0.0) for doc in candidates])
+            if not seen.all():
+                scores[~seen] = Index.find_scores(self.index.get_pl_array(word), numpy.array(candidates)[~seen])
+            totals += scores
+        for doc, total in zip(candidates, totals.tolist()):
+            # NaN if the doc is not in every PL
+            if total == total:
+                c[doc] = total / len(words)
+
+        c = heapq.nlargest(k, c.items(), key=lambda t: t[1])
         output = []
         timer.stop()
         time_tuple = timer.get_duration_tuple()
         if verbose:
             print("Query returned in {}s {}ms".format(time_tuple[1], time_tuple[2]))
 
-        for document, score in pl:
+        for document, score in c:
             output.append({'document': document, 'score': score})
+
         return output
 
-    def search_fagins(self, word_list, k, verbose=True):
+    @cached_results('threshold')
+    @measured('threshold')
+    def search_threshold(self, word_list, k, verbose=True):
+        # Threshold Algorithm: same results as Fagin's algorithm, stops as soon as the k-th score beats the threshold
         timer = Timer()
         timer.start()
-        word_list = self.prepare_query(word_list).split()
-        print(word_list)
-        pl_list = {}
+        words = self.get_top_k_words(word_list)
+        if words is None:
+            return
+        min_length = min([self.index.get_pl_length(w) for w in words]) if words else 0
+        pl_by_doc = [self.index.get_pl_array(w) for w in words]
+        top_k = []
+        evaluated = set()
         line = 0
-        c = {}
-        m = {}
-        min_length = 100
-        i = 0
-
-        # for conjunctive query, if a word is not found then no documents are returned
-        for a_word in word_list:
-            if a_word.find('&') > -1:
-                conjunctive_part = a_word.split('&')
-                for j in range(0, len(conjunctive_part)):
-                    if conjunctive_part[j] in self.index.voc:
-                        pl_list[i] = OrderedDict(
-                            sorted(self.index.read_pl_for_word(*(self.index.voc[conjunctive_part[j]]),
-                                   self.index.path).items(),
-                                   key=lambda t: t[1], reverse=True))
-                        if len(pl_list[i]) < min_length:
-                            min_length = len(pl_list[i])
-                        i += 1
-                    else:
-                        print(conjunctive_part[j] + " : Word not found")
-                        print("No documents found")
-                        return
-            # disjunctive query
-            else:
-                if a_word in self.index.voc:
-                    pl_list[i] = OrderedDict(
-                        sorted(self.index.read_pl_for_word(*(self.index.voc[a_word]),
-                                                           self.index.path).items(),
-                               key=lambda t: t[1], reverse=True))
-                    if len(pl_list[i]) < min_length:
-                        min_length = len(pl_list[i])
-                    i += 1
-                else:
-                    print(a_word + " : Word not found")
+        block = max(k, 8)
+        threshold_reached = False
 
-        # stops when C has k elements or we finished going through all the lines of pl
-        while line < min_length and len(c) < k:
-            i = 0
-            while i < len(pl_list):
-                # iterate on each line of each pl
-                if line < len(pl_list[i]):
-                    doc_id = list(pl_list[i])[line]
-                    if doc_id in m.keys():
-                        old_score = m[doc_id][0]
-                        m[doc_id][1].append(i)
-                        m[doc_id] = (((old_score + pl_list[i][doc_id]) / len(m[doc_id][1])), m[doc_id][1])
-                        if len(m[doc_id][1]) == len(pl_list):
-                            c[doc_id] = m[doc_id][0]
-                            del m[doc_id]
-                    else:
-                        # In M: doc_id -> (score, list of pl)
-                        pl_visited = list()
-                        pl_visited.append(i)
-                        m[doc_id] = (pl_list[i][doc_id], pl_visited)
-                i += 1
-            line += 1
-
-        for doc in m.keys():
-            temp_score = m[doc][0]
-            temp_length = len(m[doc][1])
-            for i in range(0, len(pl_list)):
-                if i not in m[doc][1]:
-                    if doc in pl_list[i]:
-                        temp_score = ((temp_score * temp_length) + pl_list[i][doc]) / (temp_length + 1)
-                        temp_length += 1
-                    # if doc is not in PL
-                    else:
-                        break
-
-            # check if current doc is in all posting lists and its score is greater than min score in C
-            if temp_length == len(pl_list):
-                if c:
-                    if temp_score > min(c.values()) and len(c) == k:
-                        min_entry = min(c, key=c.get)
-                        del c[min_entry]
-                        c[doc] = temp_score
-                    # case where C not full yet
-                    elif len(c) < k:
-                        c[doc] = temp_score
-                # if c is empty
-                else:
-                    c[doc] = temp_score
+        while line < min_length and not threshold_reached:
+            stop = min(line + block, min_length)
+            rows = [self.index.get_impact_pl(w, line, stop) for w in words]
+            # random access in every PL for the new docs of the block at once
+            new_docs = numpy.setdiff1d(numpy.concatenate([r['document'] for r in rows]),
+                                       numpy.fromiter(evaluated, dtype=numpy.int64, count=len(evaluated)))
+            totals = numpy.zeros(len(new_docs))
+            for pl in pl_by_doc:
+                totals += Index.find_scores(pl, new_docs)
+            total_of = dict(zip(new_docs.tolist(), totals.tolist()))
+            rows = [list(zip(r['document'].tolist(), r['score'].tolist())) for r in rows]
+            for depth in range(stop - line):
+                threshold = 0
+                for i in range(len(words)):
+                    doc_id, score = rows[i][depth]
+                    threshold += score
+                    if doc_id in evaluated:
+                        continue
+                    evaluated.add(doc_id)
+                    total = total_of[doc_id]
+                    # NaN if the doc is not in every PL
+                    if total != total:
+                        continue
+                    if len(top_k) < k:
+                        heapq.heappush(top_k, (total / len(words), doc_id))
+                    elif total / len(words) > top_k[0][0]:
+                        heapq.heapreplace(top_k, (total / len(words), doc_id))
+                if len(top_k) == k and top_k[0][0] >= threshold / len(words):
+                    threshold_reached = True
+                    break
+            line += block
+            block *= 2
 
-        c = OrderedDict(sorted(c.items(), key=lambda t: t[1], reverse=True))
         output = []
         timer.stop()
         time_tuple = timer.get_duration_tuple()
         if verbose:
             print("Query returned in {}s {}ms".format(time_tuple[1], time_tuple[2]))
 
-        for document, score in c.items():
+        for score, document in sorted(top_k, reverse=True):
             output.append({'document': document, 'score': score})
 
         return output
 
+    @cached_results('wand')
+    @measured('wand')
+    def search_wand(self, word_list, k, verbose=True):
+        # Top k disjunctive search with Block-Max WAND, skipping the blocks whose score bounds can't enter the top k
+        timer = Timer()
+        timer.start()
+        query = self.prepare_query(word_list)
+        words = query.split()
+        found = [a_word for a_word in words if a_word in self.index.voc]
+        # The bounds only hold for sums of scores without conjunctive parts or phrases, and the short posting lists
+        # cost less to score at once than to bound
+        if query.find('&') > -1 or query.find('"') > -1 \
+                or sum(self.index.count[a_word][0] for a_word in found) < WAND_MIN_ROWS:
+            output = self.score_query(words, self.index.get_pl_array, k=k)
+        else:
+            for a_word in words:
+                if a_word not in self.index.voc:
+                    print(a_word + " : Word not found")
+            output = self.score_block_max(found, k)
+            if output is None:
+                # no block can be skipped
+                output = self.score_disjunctive_query(found, self.index.get_pl_array, report=False, k=k)
+            if not output:
+                print("No document found")
+        timer.stop()
+        time_tuple = timer.get_duration_tuple()
+        if verbose:
+            print("Query returned in {}s {}ms".format(time_tuple[1], time_tuple[2]))
+        return output
+
+    def score_block_max(self, words, k):
+        """
+        Top k documents of the words, with the same scores and order as score_disjunctive_query, None if every block
+        has to be scored. The documents are cut in intervals at the first and after the last doc of every block of
+        every word, so each word has at most one block in an interval, and the bound of an interval is the sum of the
+        maximum scores of these blocks. The k intervals with the best bounds are scored first, then every interval
+        whose bound reaches the k-th score: only their rows are read, found by binary search in the posting lists.
+        """
+        lists = [posting_list for posting_list in (BlockMaxList(self.index, a_word) for a_word in words)
+                 if len(posting_list.rows)]
+        if not lists or k <= 0:
+            return []
+        boundaries = numpy.sort(numpy.concatenate([bound for posting_list in lists for bound in
+                                                   (posting_list.first_docs, posting_list.last_docs + 1)]))
+        boundaries = boundaries[numpy.append(True, boundaries[1:] != boundaries[:-1])]
+        # a doc holds at least one of the words: its score is at most the sum of the positive bounds of the words, or
+        # the biggest bound when none is positive
+        positive_bounds = numpy.zeros(len(boundaries) - 1)
+        bounds = numpy.full(len(boundaries) - 1, -numpy.inf)
+        for posting_list in lists:
+            word_bounds = posting_list.bounds(boundaries[:-1])
+            positive_bounds += numpy.maximum(word_bounds, 0)
+            bounds = numpy.maximum(bounds, word_bounds)
+        bounds = numpy.where(positive_bounds > 0, positive_bounds, bounds)
+        rows_total = sum(len(posting_list.rows) for posting_list in lists)
+
+        def find_rows(selected):
+            # ranges of rows of every word in the runs of selected intervals, and their number of rows
+            changes = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], selected, [False]))))
+            ranges = [posting_list.find_rows(boundaries[changes[::2]], boundaries[changes[1::2]])
+                      for posting_list in lists]
+            return ranges, sum(int((end_rows - first_rows).sum()) for first_rows, end_rows in ranges)
+
+        documents = numpy.empty(0, dtype=numpy.int64)
+        scores = numpy.empty(0)
+        ties = numpy.empty(0, dtype=numpy.int64)
+        scored = bounds == -numpy.inf
+        batch = k
+        rows_read = 0
+        while True:
+            candidates = ~scored & (bounds >= (scores[k - 1] if len(scores) == k else -numpy.inf))
+            if not candidates.any():
+                break
+            ranges, rows_count = find_rows(candidates)
+            selected = candidates
+            if rows_count > rows_total / 2:
+                # the intervals with the best bounds first, to raise the k-th score
+                left = numpy.flatnonzero(candidates)
+                batch = min(batch, len(left))
+                selected = numpy.zeros(len(bounds), dtype=bool)
+                selected[left[numpy.argpartition(-bounds[left], batch - 1)[:batch]]] = True
+                batch *= 2
+                ranges, rows_count = find_rows(selected)
+                rows_read += rows_count
+                if rows_read > rows_total / 8:
+                    # the k-th score stays too low to skip most of the rows, the naive approach costs less
+                    return None
+            scored |= selected
+            parts = [posting_list.read(*rows) for posting_list, rows in zip(lists, ranges)]
+            # the scores of a doc are added in the order of the words, and ties are ordered by the first word holding
+            # the doc then by doc, like the naive approach
+            batch_documents, first_seen, doc_of_row = numpy.unique(
+                numpy.concatenate([part[0] for part in parts]), return_index=True, return_inverse=True)
+            totals = numpy.bincount(doc_of_row, weights=numpy.concatenate([part[1] for part in parts]),
+                                    minlength=len(batch_documents))
+            words_of_rows = numpy.concatenate([numpy.full(len(part[0]), i) for i, part in enumerate(parts)])
+            documents = numpy.concatenate((documents, batch_documents))
+            scores = numpy.concatenate((scores, totals))
+            ties = numpy.concatenate((ties, (words_of_rows[first_seen] << 32) | batch_documents))
+            best = top_k_order(scores, k, ties)
+            documents, scores, ties = documents[best], scores[best], ties[best]
+        return [{'document': document, 'score': score} for document, score in zip(documents.tolist(), scores.tolist())]
+
+    @measured('knn')
     def knn(self, doc, k, verbose=True):
         # take the words out of the document
         timer = Timer()
         timer.start()
         doc_pl = {}
-        for word in self.index.voc:
-            found_pl = self.index.read_pl_for_word(*(self.index.voc[word]), self.index.path)
-            if doc in found_pl.keys():
-                doc_pl.update({word: found_pl[doc]})
-        pl = {}
-        for a_word in doc_pl.keys():
-            found_pl = self.index.read_pl_for_word(*(self.index.voc[a_word]), self.index.path)
-            for document, score in found_pl.items():
-                if document != doc:
-                    if document not in pl:
-                        pl[document] = 0
-                    pl[document] += score * doc_pl[a_word]
-        pl = sorted(pl.items(), key=lambda kv: kv[1], reverse=True)
-        count = 0
+        forward_entry = self.index.get_forward_entry(doc)
+        if forward_entry is not None:
+            for term_id, tf in zip(forward_entry['term'].tolist(), forward_entry['tf'].tolist()):
+                word = self.index.terms[term_id]
+                doc_pl.update({word: tf * self.index.count[word][1]})
+        else:
+            # documents indexed before the forward index: look for the doc in every PL
+            for word in self.index.voc:
+                score = float(Index.find_scores(self.index.get_pl_array(word), [doc])[0])
+                if score == score:
+                    doc_pl.update({word: score})
+        # scores of the rows of the PL of every word, added by document like the disjunctive queries
+        pls = [self.index.get_pl_array(a_word) for a_word in doc_pl.keys()]
+        documents = numpy.concatenate([found_pl['document'] for found_pl in pls]) if pls else numpy.empty(0)
+        scores = numpy.concatenate([found_pl['score'].astype(numpy.float64) * weight
+                                    for found_pl, weight in zip(pls, doc_pl.values())]) if pls else numpy.empty(0)
+        others = documents != doc
+        documents, first_seen, doc_of_row = numpy.unique(documents[others], return_index=True, return_inverse=True)
+        totals = numpy.bincount(doc_of_row, weights=scores[others], minlength=len(documents))
+        with self.index.metrics.stage('query.sort'):
+            order = top_k_order(totals, k, first_seen)
         timer.stop()
         time_tuple = timer.get_duration_tuple()
         if verbose:
             print("Query returned in {}s {}ms".format(time_tuple[1], time_tuple[2]))
-        output = []
-
-        for document, score in pl:
-            output.append({'document': document, 'score': score})
-            count += 1
-            if count == k:
-                break
 
-        return output
+        return [{'document': document, 'score': score}
+                for document, score in zip(documents[order].tolist(), totals[order].tolist())]
 
-    def similar_word(self, word, k):
+    @measured('similar')
+    def similar_words(self, word, k):
+        # The k words with the most similar context vectors, as (word, score), None if the word is not indexed
         word = self.prepare_query(word)
         if word not in self.index.voc:
+            return None
+        context_vectors = self.index.context_vectors[:len(self.index.terms)]
+        word_id = self.index.term_ids[word]
+        # cosine with every word at once, the vectors are normalized
+        word_scores = context_vectors @ context_vectors[word_id]
+        word_scores[word_id] = 0
+        k = min(k, len(word_scores))
+        best = numpy.argpartition(-word_scores, k - 1)[:k] if k > 0 else []
+        return [(self.index.terms[w], float(word_scores[w]))
+                for w in sorted(best, key=lambda term_id: word_scores[term_id], reverse=True)]
+
+    def similar_word(self, word, k):
+        words = self.similar_words(word, k)
+        if words is None:
             print("Word not found")
             return
-        context_vec = self.index.context_vectors[word]
-        word_scores = {}
-        for w in self.index.voc:
-            word_scores[w] = numpy.dot(self.index.context_vectors[w], context_vec)
-        word_scores[word] = 0
-        word_scores = sorted(word_scores.items(), key=lambda kv: kv[1], reverse=True)
-        count = 0
-        for w, score in word_scores:
-            print(w, '---', 'Score: ', score)
-            count += 1
-            if count == k:
-                break
+        for similar, score in words:
+            print(similar, '---', 'Score: ', score)
+
+
+def search_many_in_process(job):
+    # Runs in the search_many workers
+    path, line_filters, word_filters, queries, k = job
+    index = Index(path, line_filters, word_filters, load=True, verbose=False, pl_cache_size=0)
+    return Searcher(index, cache_size=0).search_many(queries, k)
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from shards import ShardedSearcher
+from timer import Timer
+
+
+class QueryServer:
+    """
+    Serves the searches of one loaded index over TCP. Each request is a line of JSON, like
+    {"id": 1, "method": "search", "query": "nuclear power", "k": 10}, and gets a line of JSON with the same id, the
+    result and the time spent on the request. Requests of a connection and of different connections are handled
+    concurrently, the searches run in a pool of threads as they read the posting lists from the disk.
+    """
+    def __init__(self, searcher, reader, workers=4, verbose=True):
+        self.searcher = searcher
+        self.reader = reader
+        self.executor = ThreadPoolExecutor(workers)
+        self.verbose = verbose
+        self.requests_served = 0
+        self.total_latency = 0
+        self.methods = {
+            'search': lambda request: self.searcher.search(request['query'], False, request.get('k')),
+            'fagins': lambda request: self.searcher.search_fagins(request['query'], request['k'], False),
+            'threshold': lambda request: self.searcher.search_threshold(request['query'], request['k'], False),
+            'wand': lambda request: self.searcher.search_wand(request['query'], request['k'], False),
+            'knn': lambda request: self.searcher.knn(request['doc'], request['k'], False),
+            'similar': lambda request: self.searcher.similar_words(request['word'], request['k']),
+            'read': lambda request: {'title': self.reader.get_doc_title(request['doc']).strip(),
+                                     'text': self.reader.read_doc(request['doc'])},
+            'metrics': lambda request: self.searcher.index.metrics.to_prometheus()
+            if request.get('format') == 'prometheus' else self.searcher.index.metrics.snapshot(),
+        }
+        if isinstance(searcher, ShardedSearcher):
+            # the vectors of the documents and words are split between the shards
+            self.methods['knn'] = self.methods['similar'] = QueryServer.not_sharded
+
+    @staticmethod
+    def not_sharded(request):
+        raise ValueError("{} is not available on a sharded index".format(request['method']))
+
+    async def handle_request(self, line):
+        timer = Timer()
+        timer.start()
+        response = {}
+        try:
+            request = json.loads(line)
+            response['id'] = request.get('id')
+            method = self.methods[request['method']]
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, method, request)
+            response.update({'ok': True, 'result': result})
+        except Exception as e:
+            # the error is sent back, the connection stays open
+            response.update({'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)})
+        timer.stop()
+        latency = timer.float_duration * 1000
+        response['latency_ms'] = latency
+        self.requests_served += 1
+        self.total_latency += latency
+        if self.verbose:
+            print("{} {} in {:.3f}ms".format(response.get('id'), 'ok' if response['ok'] else 'failed', latency))
+        return response
+
+    async def handle_connection(self, reader, writer):
+        # The responses are written as soon as they are ready, not in the order of the requests
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(line):
+            response = await self.handle_request(line)
+            async with write_lock:
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        if self.verbose:
+            print("Serving on {}".format(', '.join(str(s.getsockname()) for s in server.sockets)))
+        if ready is not None:
+            ready.set_result(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host, port):
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown()
+            if self.requests_served:
+                print("Served {} requests, average latency {:.3f}ms"
+                      .format(self.requests_served, self.total_latency / self.requests_served))
+
+
+async def send_requests(host, port, requests):
+    # Client: sends the requests on one connection and returns the responses in the order of the requests
+    reader, writer = await asyncio.open_connection(host, port)
+    for i, request in enumerate(requests):
+        writer.write(json.dumps(dict(request, id=i)).encode('utf-8') + b'\n')
+    await writer.drain()
+    responses = [None] * len(requests)
+    for _ in requests:
+        response = json.loads(await reader.readline())
+        responses[response['id']] = response
+    writer.close()
+    await writer.wait_closed()
+    return responses
@@ -0,0 +1,212 @@
+import heapq
+import itertools
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+from collections import Counter
+
+from index import Index
+import metrics
+from search import Searcher
+from timer import Timer
+
+
+class ShardedIndex:
+    """
+    Documents of the collection split between shards, each one a segmented Index with its own posting lists and
+    vocabulary at path+'_shard<n>'. The files of every indexed folder are dealt to the shards by their index, so the
+    shard of a document is its file index modulo the number of shards. After each folder, the shards are given the DF
+    and number of documents of the whole collection: a document gets the same score as in a single index.
+    """
+    def __init__(self, path, line_preparation, word_preparation, shards_count=2, load=False, verbose=True,
+                 score_bits=None, impact=False, pl_cache_size=64 * 2 ** 20, positional=False):
+        self.path = path
+        self.shards_path = path + '_shards'
+        self.line_filters = line_preparation
+        self.word_filters = word_preparation
+        self.pl_cache_size = pl_cache_size
+        self.generation = 0
+        # Timings of the coordinator, each shard process has its own
+        self.metrics = metrics.Metrics()
+        if load and os.path.exists(self.shards_path):
+            # the number of shards of a loaded index is kept
+            with open(self.shards_path, 'rb') as f:
+                shards_count = pickle.load(f)['shards']
+        self.shards = [Index('{}_shard{}'.format(path, n), line_preparation, word_preparation, load, verbose,
+                             score_bits, impact, segmented=True, pl_cache_size=pl_cache_size, positional=positional)
+                       for n in range(shards_count)]
+        self.documents = ShardDocuments(self)
+
+    @property
+    def directories(self):
+        # every shard indexes every folder
+        return self.shards[0].directories
+
+    @property
+    def docs_indexed(self):
+        return sum(shard.docs_indexed for shard in self.shards)
+
+    def shard_of(self, doc_id):
+        return doc_id // 10 ** 6 % len(self.shards)
+
+    def index_folder(self, folder_name, batch_size, progress_bar=False, spimi=False, workers=1):
+        for n, shard in enumerate(self.shards):
+            print("Shard {}:".format(n))
+            shard.index_folder(folder_name, batch_size, progress_bar, spimi, workers, shard=(n, len(self.shards)))
+        self.update_idf()
+        with open(self.shards_path, 'wb') as f:
+            pickle.dump({'shards': len(self.shards)}, f, pickle.HIGHEST_PROTOCOL)
+        self.generation += 1
+
+    def update_idf(self):
+        # The DF of a word is the sum of its DF in every shard
+        document_freqs = Counter()
+        for shard in self.shards:
+            shard.load_dictionary_in_memory()
+            for w, counts in shard.count.items():
+                document_freqs[w] += counts[0]
+        for shard in self.shards:
+            shard.update_idf(document_freqs, self.docs_indexed)
+            shard.save_voc()
+
+    def compact(self):
+        for shard in self.shards:
+            shard.compact()
+        self.generation += 1
+
+    def stats(self):
+        return {'shards': [shard.stats() for shard in self.shards]}
+
+    def print_index_stats(self):
+        for n, shard in enumerate(self.shards):
+            print("Shard {}".format(n))
+            shard.print_index_stats()
+
+
+class ShardDocuments:
+    # Document stores of the shards, for the Reader
+    def __init__(self, index):
+        self.index = index
+
+    def find(self, doc_id):
+        return self.index.shards[self.index.shard_of(doc_id)].documents.find(doc_id)
+
+
+class ShardedSearcher:
+    """
+    Scatter-gather search over the shards of a ShardedIndex: each shard is loaded and searched by its own process.
+    A query is sent to every shard at once, each one returns its top k documents, and the lists sorted by score are
+    merged. The processes are started on the first query, and started again when the index changed.
+    """
+    def __init__(self, index, cache_size=256, cache_ttl=None):
+        self.index = index
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.connections = None
+        self.processes = []
+        self.generation = None
+        # a request and its responses must not be interleaved with those of another thread
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.connections = []
+        for shard in self.index.shards:
+            connection, shard_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_shard, daemon=True,
+                                              args=(shard.path, self.index.line_filters, self.index.word_filters,
+                                                    self.index.pl_cache_size, self.cache_size, self.cache_ttl,
+                                                    shard_connection))
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.generation = self.index.generation
+
+    def close(self):
+        if self.connections is None:
+            return
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+        self.connections = None
+        self.processes = []
+
+    def scatter(self, method, arguments, limit=None):
+        # Results of the Searcher method in every shard, cut to limit documents
+        with self.lock:
+            if self.connections is None or self.generation != self.index.generation:
+                self.close()
+                self.start()
+            for connection in self.connections:
+                connection.send((method, arguments, limit))
+            results = [connection.recv() for connection in self.connections]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    @staticmethod
+    def merge(shard_results, k=None):
+        # The shards hold different documents, so the top k is in the top k of the shards. None if every shard
+        # returned None (a word of a conjunctive part is missing)
+        if all(results is None for results in shard_results):
+            return None
+        merged = heapq.merge(*[results for results in shard_results if results is not None],
+                             key=lambda result: -result['score'])
+        return list(itertools.islice(merged, k))
+
+    def gather(self, method, k, arguments, verbose):
+        timer = Timer()
+        timer.start()
+        with self.index.metrics.stage('query.scatter'):
+            shard_results = self.scatter(method, arguments, k)
+        with self.index.metrics.stage('query.merge'):
+            output = ShardedSearcher.merge(shard_results, k)
+        timer.stop()
+        mode = method.replace('search_', '', 1)
+        self.index.metrics.count('query.' + mode)
+        self.index.metrics.observe('query.latency.' + mode, timer.float_duration)
+        if verbose:
+            if not output:
+                print("No document found")
+            time_tuple = timer.get_duration_tuple()
+            print("Query returned from {} shards in {}s {}ms".format(len(self.index.shards), time_tuple[1],
+                                                                     time_tuple[2]))
+        return output
+
+    def search(self, word_list, verbose=True, k=None):
+        return self.gather('search', k, (word_list, False, k), verbose)
+
+    def search_fagins(self, word_list, k, verbose=True):
+        return self.gather('search_fagins', k, (word_list, k, False), verbose)
+
+    def search_threshold(self, word_list, k, verbose=True):
+        return self.gather('search_threshold', k, (word_list, k, False), verbose)
+
+    def search_wand(self, word_list, k, verbose=True):
+        return self.gather('search_wand', k, (word_list, k, False), verbose)
+
+    def search_many(self, queries, k=None):
+        shard_results = self.scatter('search_many', (queries, k))
+        return [ShardedSearcher.merge(query_results, k) for query_results in zip(*shard_results)]
+
+
+def run_shard(path, line_filters, word_filters, pl_cache_size, cache_size, cache_ttl, connection):
+    # Process of a shard: answers (Searcher method, arguments, limit) requests until it gets None
+    # the messages of the searches would be repeated by every shard
+    sys.stdout = open(os.devnull, 'w')
+    index = Index(path, line_filters, word_filters, load=True, verbose=False, pl_cache_size=pl_cache_size)
+    searcher = Searcher(index, cache_size, cache_ttl)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        method, arguments, limit = request
+        try:
+            results = getattr(searcher, method)(*arguments)
+            connection.send(results[:limit] if results is not None else None)
+        except Exception as e:
+            connection.send(e)
+    connection.close()
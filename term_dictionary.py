@@ -0,0 +1,155 @@
+import mmap
+import os
+import struct
+from collections.abc import Mapping, Sequence
+import numpy
+
+MAGIC = b'TDIC'
+VERSION = 1
+# magic, version, number of terms, number of term ids, terms per front coding block, padding
+HEADER = struct.Struct('<4sIIIII')
+# Fixed-width data of a term, in the order of the sorted terms
+TERM_ROW = numpy.dtype([('offset', '<u8'), ('length', '<u4'), ('df', '<u4'), ('idf', '<f8'), ('max_score', '<f8'),
+                        ('term_id', '<u4'), ('impact_length', '<u4'), ('impact_offset', '<u8')])
+ENTRY = struct.Struct('<HH')
+
+
+class TermDictionary:
+    """
+    Sorted terms of the vocabulary with the position of their PL and their stats, read through a memory map.
+    Terms are front coded by blocks: each term keeps the length of the prefix it shares with the previous one of
+    the block and the rest of its bytes. A term is found by binary search on the first term of every block.
+    """
+    def __init__(self, path, cache_size=10000):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.terms_count, ids_count, self.block_size, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unknown term dictionary format")
+        offset = HEADER.size
+        self.rows = numpy.frombuffer(self.map, dtype=TERM_ROW, count=self.terms_count, offset=offset)
+        offset += self.rows.nbytes
+        self.id_to_row = numpy.frombuffer(self.map, dtype='<u4', count=ids_count, offset=offset)
+        offset += self.id_to_row.nbytes
+        blocks_count = (self.terms_count + self.block_size - 1) // self.block_size
+        self.block_offsets = numpy.frombuffer(self.map, dtype='<u8', count=blocks_count, offset=offset)
+        self.strings_offset = offset + self.block_offsets.nbytes
+        self.cache_size = cache_size
+        self.cache = {}
+
+    @staticmethod
+    def write(path, entries, id_to_row, block_size=16):
+        # entries: sorted list of (term, TERM_ROW values), id_to_row: row of the term of each term id
+        strings = bytearray()
+        block_offsets = []
+        previous = b''
+        for i, (term, _) in enumerate(entries):
+            encoded = term.encode('utf-8')
+            if i % block_size == 0:
+                block_offsets.append(len(strings))
+                prefix = 0
+            else:
+                prefix = len(os.path.commonprefix([previous, encoded]))
+            strings += ENTRY.pack(prefix, len(encoded) - prefix) + encoded[prefix:]
+            previous = encoded
+        rows = numpy.array([values for _, values in entries], dtype=TERM_ROW)
+        temp_path = path + '_temp'
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(entries), len(id_to_row), block_size, 0))
+            f.write(rows.tobytes())
+            f.write(numpy.asarray(id_to_row, dtype='<u4').tobytes())
+            f.write(numpy.asarray(block_offsets, dtype='<u8').tobytes())
+            f.write(strings)
+        os.replace(temp_path, path)
+
+    def __len__(self):
+        return self.terms_count
+
+    def read_block(self, block):
+        offset = self.strings_offset + int(self.block_offsets[block])
+        terms = []
+        previous = b''
+        for _ in range(min(self.block_size, self.terms_count - block * self.block_size)):
+            prefix, suffix_len = ENTRY.unpack_from(self.map, offset)
+            offset += ENTRY.size
+            previous = previous[:prefix] + self.map[offset:offset + suffix_len]
+            offset += suffix_len
+            terms.append(previous.decode('utf-8'))
+        return terms
+
+    def first_term(self, block):
+        offset = self.strings_offset + int(self.block_offsets[block])
+        length = ENTRY.unpack_from(self.map, offset)[1]
+        return self.map[offset + ENTRY.size:offset + ENTRY.size + length].decode('utf-8')
+
+    def find(self, term):
+        # Row of the term, -1 if it is not in the dictionary
+        row = self.cache.get(term)
+        if row is not None:
+            return row
+        low, high = 0, len(self.block_offsets) - 1
+        block = -1
+        while low <= high:
+            middle = (low + high) // 2
+            if self.first_term(middle) <= term:
+                block = middle
+                low = middle + 1
+            else:
+                high = middle - 1
+        row = -1
+        if block >= 0:
+            terms = self.read_block(block)
+            if term in terms:
+                row = block * self.block_size + terms.index(term)
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[term] = row
+        return row
+
+    def term_at(self, row):
+        return self.read_block(row // self.block_size)[row % self.block_size]
+
+    def __iter__(self):
+        for block in range(len(self.block_offsets)):
+            yield from self.read_block(block)
+
+
+class DictionaryView(Mapping):
+    # Read-only dict-like access to some fields of the dictionary rows, by term
+    def __init__(self, dictionary, fields, mask_field=None):
+        self.dictionary = dictionary
+        self.fields = fields
+        # field that is 0 for the terms missing from this view
+        self.mask_field = mask_field
+
+    def __getitem__(self, term):
+        row = self.dictionary.find(term) if isinstance(term, str) else -1
+        if row < 0 or (self.mask_field is not None and self.dictionary.rows[row][self.mask_field] == 0):
+            raise KeyError(term)
+        values = self.dictionary.rows[row]
+        if len(self.fields) == 1:
+            return values[self.fields[0]].item()
+        return tuple(values[field].item() for field in self.fields)
+
+    def __iter__(self):
+        if self.mask_field is None:
+            return iter(self.dictionary)
+        present = self.dictionary.rows[self.mask_field] != 0
+        return (term for term, keep in zip(self.dictionary, present) if keep)
+
+    def __len__(self):
+        if self.mask_field is None:
+            return len(self.dictionary)
+        return int(numpy.count_nonzero(self.dictionary.rows[self.mask_field]))
+
+
+class TermsView(Sequence):
+    # Read-only list-like access to the terms, by term id
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+
+    def __getitem__(self, term_id):
+        return self.dictionary.term_at(int(self.dictionary.id_to_row[term_id]))
+
+    def __len__(self):
+        return len(self.dictionary.id_to_row)
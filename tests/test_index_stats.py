@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import index  # noqa: E402
+import index_stats  # noqa: E402
+import text_preprocessing  # noqa: E402
+
+
+class EmptyIndexStatsTest(unittest.TestCase):
+    def test_report_of_an_empty_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            empty = index.Index(os.path.join(directory, 'pl'),
+                                text_preprocessing.get_instances_of_all_line_preparators(stopwords=False),
+                                text_preprocessing.get_instances_of_all_word_preparators(stemming=False),
+                                load=False, verbose=False)
+            stats = index_stats.compute(empty)
+            self.assertEqual(stats['terms'], 0)
+            self.assertEqual(stats['document_frequency'], {})
+            self.assertEqual(stats['distinct_words_per_document'], {})
+            report = index_stats.format_report(stats)
+            self.assertIn("Documents: 0, terms: 0, postings: 0", report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,12 @@
+import functools
 import re
 
 # pip install stemming
 from stemming.porter2 import stem
 
+# Characters replaced by spaces, with the numbers
+FILTER_CHARACTERS = r'. ()\[\]\-",:;\n!?'
+
 
 class ILinePreparation:
     def prepare_line(self, line):
@@ -13,6 +17,9 @@ class IWordPreparation:
     def prepare_word(self, text):
         raise NotImplementedError("All inheriting word preparators should implement this method")
 
+    def prepare_words(self, words):
+        return [self.prepare_word(word) for word in words]
+
 
 class LowercasePreparation(ILinePreparation):
     def prepare_line(self, line):
@@ -21,29 +28,29 @@ class LowercasePreparation(ILinePreparation):
 
 class DeleteCharacterPreparation(ILinePreparation):
     def __init__(self):
-        self.filter_characters = '[. ()\[\]\-",:;\n!?]|[0-9]+'
+        self.filter_characters = re.compile('[' + FILTER_CHARACTERS + ']|[0-9]+')
 
     def prepare_line(self, line):
-        return re.sub(self.filter_characters, ' ', line)
+        return self.filter_characters.sub(' ', line)
 
 class StopwordPreparation(ILinePreparation):
     def __init__(self):
-        self.stoppers = ["a", "about", "above", "after", "again", "against", "all", "am", "an", "and", "any", "are",
-                         "aren't", "as", "at", "be", "because", "been", "before", "being", "below", "between", "both",
-                         "but", "by", "can't", "cannot", "could", "couldn't", "did", "didn't", "do", "does", "doesn't",
-                         "doing", "don't", "down", "during", "each", "few", "for", "from", "further", "had", "hadn't",
-                         "has", "hasn't", "have", "haven't", "having", "he", "he'd", "he'll", "he's", "her", "here",
-                         "here's", "hers", "herself", "him", "himself", "his", "how", "how's", "i", "i'd", "i'll",
-                         "i'm", "i've", "if", "in", "into", "is", "isn't", "it", "it's", "its", "itself", "let's", "me",
-                         "more", "most", "mustn't", "my", "myself", "no", "nor", "not", "of", "off", "on", "once",
-                         "only", "or", "other", "ought", "our", "ours", "ourselves", "out", "over", "own", "same",
-                         "shan't", "she", "she'd", "she'll", "she's", "should", "shouldn't", "so", "some", "such",
-                         "than", "that", "that's", "the", "their", "theirs", "them", "themselves", "then", "there",
-                         "there's", "these", "they", "they'd", "they'll", "they're", "they've", "this", "those",
-                         "through", "to", "too", "under", "until", "up", "very", "was", "wasn't", "we", "we'd", "we'll",
-                         "we're", "we've", "were", "weren't", "what", "what's", "when", "when's", "where", "where's",
-                         "which", "while", "who", "who's", "whom", "why", "why's", "with", "won't", "would", "wouldn't",
-                         "you", "you'd", "you'll", "you're", "you've", "your", "yours", "yourself", "yourselves"]
+        self.stoppers = frozenset([
+            "a", "about", "above", "after", "again", "against", "all", "am", "an", "and", "any", "are", "aren't", "as",
+            "at", "be", "because", "been", "before", "being", "below", "between", "both", "but", "by", "can't",
+            "cannot", "could", "couldn't", "did", "didn't", "do", "does", "doesn't", "doing", "don't", "down", "during",
+            "each", "few", "for", "from", "further", "had", "hadn't", "has", "hasn't", "have", "haven't", "having",
+            "he", "he'd", "he'll", "he's", "her", "here", "here's", "hers", "herself", "him", "himself", "his", "how",
+            "how's", "i", "i'd", "i'll", "i'm", "i've", "if", "in", "into", "is", "isn't", "it", "it's", "its",
+            "itself", "let's", "me", "more", "most", "mustn't", "my", "myself", "no", "nor", "not", "of", "off", "on",
+            "once", "only", "or", "other", "ought", "our", "ours", "ourselves", "out", "over", "own", "same", "shan't",
+            "she", "she'd", "she'll", "she's", "should", "shouldn't", "so", "some", "such", "than", "that", "that's",
+            "the", "their", "theirs", "them", "themselves", "then", "there", "there's", "these", "they", "they'd",
+            "they'll", "they're", "they've", "this", "those", "through", "to", "too", "under", "until", "up", "very",
+            "was", "wasn't", "we", "we'd", "we'll", "we're", "we've", "were", "weren't", "what", "what's", "when",
+            "when's", "where", "where's", "which", "while", "who", "who's", "whom", "why", "why's", "with", "won't",
+            "would", "wouldn't", "you", "you'd", "you'll", "you're", "you've", "your", "yours", "yourself", "yourselves"
+        ])
 
     def prepare_line(self, line):
         query_words = line.split()
@@ -51,11 +58,61 @@ class StopwordPreparation(ILinePreparation):
         result_words = [word for word in query_words if word.lower() not in self.stoppers]
         return ' '.join(result_words)
 
+@functools.lru_cache(maxsize=1 << 17)
+def cached_stem(word):
+    # Most words of the documents and queries repeat, they are stemmed once per process
+    return stem(word)
+
+
 class StemmingPreparation(IWordPreparation):
     def prepare_word(self, word):
-        return stem(word)
-        # return word
-        # faster
+        return cached_stem(word)
+
+    def prepare_words(self, words):
+        return list(map(cached_stem, words))
+
+
+class Tokenizer:
+    """
+    Splits a text into words with the line filters, then applies the word filters to each word.
+    The line filters of get_instances_of_all_line_preparators are fused: the words are found by a single regex on the
+    lowercased text, and the stopwords are removed from the words instead of rebuilding the line.
+    """
+    def __init__(self, line_filters, word_filters):
+        self.line_filters = line_filters
+        self.word_filters = word_filters
+        self.word_pattern = None
+        self.stopwords = frozenset()
+        filter_types = [type(line_filter) for line_filter in line_filters]
+        if filter_types[:2] == [LowercasePreparation, DeleteCharacterPreparation] \
+                and all(filter_type is StopwordPreparation for filter_type in filter_types[2:]):
+            # the stopword filter splits the line on every whitespace
+            separators = FILTER_CHARACTERS + '0-9' + (r'\s' if len(filter_types) > 2 else '')
+            self.word_pattern = re.compile('[^' + separators + ']+')
+            self.stopwords = frozenset().union(*(line_filter.stoppers for line_filter in line_filters[2:]))
+
+    def prepare_line(self, line):
+        for line_filter in self.line_filters:
+            line = line_filter.prepare_line(line)
+        return line
+
+    def prepare_words(self, words):
+        for word_filter in self.word_filters:
+            words = word_filter.prepare_words(words)
+        return words
+
+    def tokenize(self, text):
+        # Non-empty words of the text, the same as splitting the prepared line on spaces and preparing each word
+        if self.word_pattern is None:
+            words = [word for word in self.prepare_line(text).split(" ") if word != ""]
+        else:
+            words = self.word_pattern.findall(text.lower())
+            if self.stopwords:
+                words = [word for word in words if word not in self.stopwords]
+        if not self.word_filters:
+            return words
+        return [word for word in self.prepare_words(words) if word != ""]
+
 
 def get_instances_of_all_word_preparators(stemming=False):
     return [StemmingPreparation()] if stemming else []
@@ -0,0 +1,70 @@
+from collections.abc import Mapping
+import numpy
+
+# (length, offset) of the entry of a document in the forward index or in the positions file, sorted by document
+DOCUMENT_ENTRY_ROW = numpy.dtype([('document', '<u4'), ('length', '<u4'), ('offset', '<u8')])
+
+
+def document_entries(entries):
+    # Rows of a doc_id -> (length, offset) dict or view, sorted by document
+    if isinstance(entries, DocumentEntriesView):
+        return entries.rows
+    return numpy.array(sorted((doc_id, length, offset) for doc_id, (length, offset) in entries.items()),
+                       dtype=DOCUMENT_ENTRY_ROW).reshape(-1)
+
+
+def term_arrays(arrays, term_ids, terms_count):
+    # Offsets by term id and values of a word -> array dict or view: the array of term id i is
+    # values[offsets[i]:offsets[i + 1]], empty for the words without one
+    lengths = numpy.zeros(terms_count, dtype=numpy.int64)
+    by_term_id = sorted((term_ids[w], values) for w, values in arrays.items())
+    for term_id, values in by_term_id:
+        lengths[term_id] = len(values)
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths)))
+    values = numpy.concatenate([values for _, values in by_term_id]) if by_term_id else numpy.empty(0)
+    return offsets, values.astype(numpy.float64)
+
+
+class DocumentEntriesView(Mapping):
+    # Read-only dict-like access to the (length, offset) of the entry of each document, by binary search on the rows
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __getitem__(self, doc_id):
+        if not isinstance(doc_id, (int, numpy.integer)) or not 0 <= doc_id < 1 << 32:
+            raise KeyError(doc_id)
+        # the same type as the rows, the whole column would be converted otherwise
+        row = int(numpy.searchsorted(self.rows['document'], numpy.uint32(doc_id)))
+        if row == len(self.rows) or self.rows[row]['document'] != doc_id:
+            raise KeyError(doc_id)
+        return int(self.rows[row]['length']), int(self.rows[row]['offset'])
+
+    def __iter__(self):
+        return iter(self.rows['document'].tolist())
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class TermArraysView(Mapping):
+    # Read-only dict-like access to the arrays of the words saved one after the other, by word
+    def __init__(self, term_ids, terms, offsets, values):
+        self.term_ids = term_ids
+        self.terms = terms
+        self.offsets = offsets
+        self.values = values
+
+    def __getitem__(self, word):
+        term_id = self.term_ids.get(word)
+        if term_id is None or term_id + 1 >= len(self.offsets):
+            raise KeyError(word)
+        start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+        if start == end:
+            raise KeyError(word)
+        return self.values[start:end]
+
+    def __iter__(self):
+        return (self.terms[term_id] for term_id in numpy.flatnonzero(numpy.diff(self.offsets)).tolist())
+
+    def __len__(self):
+        return int(numpy.count_nonzero(numpy.diff(self.offsets)))